@@ -23,6 +23,17 @@ app.autodiscover_tasks()
 
 app.conf.timezone = 'Asia/Shanghai'
 
+# Locks of QueueOnce tasks, a job lifecycle task is not queued twice.
+# Without CELERY_ONCE_URL lifecycle tasks are queued as plain tasks, unlocked
+if os.environ.get('CELERY_ONCE_URL'):
+    app.conf.ONCE = {
+        'backend': 'celery_once.backends.Redis',
+        'settings': {
+            'url': os.environ['CELERY_ONCE_URL'],
+            'default_timeout': int(os.environ.get('CELERY_ONCE_TIMEOUT', 60 * 60)),
+        }
+    }
+
 # Add periodic-tasks
 app.conf.beat_schedule = {
 }
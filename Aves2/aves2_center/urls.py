@@ -24,5 +24,4 @@ from aves2_center import views
 urlpatterns = [
     path('', views.home, name='aves_home'),
     path('token/', views.token, name='aves_token'),
-    path('<int:page>/', views.home, name='aves_jobs'),
 ]
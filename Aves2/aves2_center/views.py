@@ -5,29 +5,67 @@ from django.conf import settings
 from django.template import loader
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login
-from django.core.paginator import Paginator
+from django.db.models import Prefetch
 
 from rest_framework.authtoken.models import Token
 from job_manager.models import AvesJob, AvesWorker
+from job_manager.utils.job_counter import get_job_counts, ALL_USERS
 
 
 logger = logging.getLogger('aves2')
 
 
+PAGE_SIZE = 10
+
+# columns rendered by aves2_center/index.html
+JOB_FIELDS = ('id', 'name', 'username', 'namespace', 'job_id', 'image', 'status', 'msg')
+WORKER_FIELDS = ('id', 'avesjob_id', 'avesrole', 'role_index', 'cpu_request', 'mem_request', 'gpu_request')
+
+
 @login_required
-def home(request, page=1):
+def home(request):
+    """ Job list of the dashboard
+
+    Jobs are paged by id: `?before=<id>` shows older jobs, `?after=<id>`
+    newer ones, so no page needs a COUNT(*) or an OFFSET scan.
+    """
     if request.user.is_active and request.user.is_superuser:
-        jobs = AvesJob.objects.all().order_by('-id')
+        jobs = AvesJob.objects.all()
+        count_user = ALL_USERS
     else:
-        jobs = AvesJob.objects.all()\
-                .filter(username=request.user.username).order_by('-id')
-    paginator = Paginator(jobs, 10)
-    if not page:
-        page = 1
+        jobs = AvesJob.objects.all().filter(username=request.user.username)
+        count_user = request.user.username
+    job_counts = get_job_counts(jobs, count_user, [s for s, _ in AvesJob.STATUS_MAP])
+
+    page_jobs = jobs.only(*JOB_FIELDS).prefetch_related(
+                    Prefetch('aves_worker', queryset=AvesWorker.objects.only(*WORKER_FIELDS).order_by('id')))
+    try:
+        before = int(request.GET['before']) if request.GET.get('before') else None
+        after = int(request.GET['after']) if request.GET.get('after') else None
+    except ValueError:
+        before = after = None
+
+    if after is not None:
+        page_data = list(page_jobs.filter(id__gt=after).order_by('id')[:PAGE_SIZE + 1])
+        has_newer = len(page_data) > PAGE_SIZE
+        page_data = page_data[:PAGE_SIZE][::-1]
+        has_older = True
     else:
-        page = int(page)
-    page_data = paginator.page(page)
-    context = {'jobs': page_data}
+        if before is not None:
+            page_jobs = page_jobs.filter(id__lt=before)
+        page_data = list(page_jobs.order_by('-id')[:PAGE_SIZE + 1])
+        has_older = len(page_data) > PAGE_SIZE
+        page_data = page_data[:PAGE_SIZE]
+        has_newer = before is not None
+
+    context = {
+        'jobs': page_data,
+        'job_counts': [(status, job_counts[status]) for status, _ in AvesJob.STATUS_MAP],
+        'has_older': has_older and bool(page_data),
+        'has_newer': has_newer and bool(page_data),
+        'first_id': page_data[0].id if page_data else None,
+        'last_id': page_data[-1].id if page_data else None,
+    }
     return render(request, 'aves2_center/index.html', context)
 
 
@@ -0,0 +1,74 @@
+import logging
+
+logger = logging.getLogger('aves2')
+
+LOG_CHUNK_SIZE = 16 * 1024
+MAX_LINE_BYTES = 64 * 1024
+
+
+def iter_lines(chunks, limit_bytes=None, on_close=None):
+    """ Split a stream of byte chunks into lines
+
+    Only the current partial line is buffered, lines longer than
+    MAX_LINE_BYTES are cut, so memory stays bounded however large the log
+    is. The upstream stream is read only as fast as lines are consumed.
+
+    :param chunks: iterable of bytes
+    :param limit_bytes: stop after this many bytes are read
+    :param on_close: called when the generator is exhausted or closed
+    :return: generator of str lines without line endings
+    """
+    buf = b''
+    read_bytes = 0
+    try:
+        for chunk in chunks:
+            if limit_bytes is not None:
+                chunk = chunk[:max(limit_bytes - read_bytes, 0)]
+            read_bytes += len(chunk)
+            buf += chunk
+            lines = buf.split(b'\n')
+            buf = lines.pop()
+            for line in lines:
+                yield line.rstrip(b'\r').decode('utf-8', 'replace')
+            if len(buf) > MAX_LINE_BYTES:
+                yield buf.decode('utf-8', 'replace')
+                buf = b''
+            if limit_bytes is not None and read_bytes >= limit_bytes:
+                break
+        if buf:
+            yield buf.rstrip(b'\r').decode('utf-8', 'replace')
+    finally:
+        if on_close is not None:
+            try:
+                on_close()
+            except Exception:
+                logger.warning('Fail to close log stream', exc_info=True)
+
+
+class LogLines(object):
+    """ Lines of a log stream, see iter_lines
+
+    close() is called by the thread which reads the lines. abort() may be
+    called from any other thread, it breaks the connection so that a read
+    blocked on a quiet followed log returns at once.
+    """
+    def __init__(self, chunks, limit_bytes=None, on_close=None, on_abort=None):
+        self._lines = iter_lines(chunks, limit_bytes=limit_bytes, on_close=on_close)
+        self._on_abort = on_abort
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._lines)
+
+    def close(self):
+        self._lines.close()
+
+    def abort(self):
+        if self._on_abort is None:
+            return
+        try:
+            self._on_abort()
+        except Exception:
+            logger.warning('Fail to abort log stream', exc_info=True)
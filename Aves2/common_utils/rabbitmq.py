@@ -1,5 +1,10 @@
+import time
+import logging
+
 import pika
 
+logger = logging.getLogger('aves2')
+
 
 def get_connection(rabbitmq_host, rabbitmq_user, rabbitmq_pass):
     credentials = pika.PlainCredentials(rabbitmq_user, rabbitmq_pass)
@@ -9,3 +14,78 @@ def get_connection(rabbitmq_host, rabbitmq_user, rabbitmq_pass):
                                            credentials)
     connection = pika.BlockingConnection(parameters)
     return connection
+
+
+class BatchPublisher(object):
+    """ Long-lived publisher which sends a batch in one transaction
+
+    One connection is kept open and reused across batches. The messages of
+    a batch are published in order and committed with one tx_commit, so a
+    batch waits for the broker once. A failed batch is retried as a whole
+    on a new connection. Call keepalive() while idle to serve heartbeats.
+    """
+    def __init__(self, host, user, password, exchange, exchange_type, routing_key, max_retries=5):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+        self.routing_key = routing_key
+        self.max_retries = max_retries
+
+        self._connection = None
+        self._channel = None
+
+    def publish_batch(self, bodies):
+        """ Publish messages in order
+
+        :return: number of messages committed to the broker, all or 0
+        """
+        for attempt in range(self.max_retries):
+            try:
+                if self._channel is None or not self._channel.is_open:
+                    self._connect()
+                for body in bodies:
+                    self._channel.basic_publish(exchange=self.exchange,
+                                                routing_key=self.routing_key,
+                                                body=body,
+                                                properties=pika.BasicProperties(delivery_mode=2))
+                self._channel.tx_commit()
+                logger.info(f'Send {len(bodies)} job status reports')
+                return len(bodies)
+            except Exception:
+                logger.warning(f'Fail to publish status reports, attempt {attempt + 1}', exc_info=True)
+                self._close()
+                time.sleep(min(2 ** attempt * 0.1, 5))
+        for body in bodies:
+            logger.error(f'Fail to send job status report: {body}')
+        return 0
+
+    def keepalive(self):
+        """ Serve heartbeats of the idle connection
+        """
+        try:
+            if self._connection and self._connection.is_open:
+                self._connection.process_data_events(time_limit=0)
+        except Exception:
+            logger.warning('rabbitmq connection lost while idle', exc_info=True)
+            self._close()
+
+    def _connect(self):
+        self._close()
+        self._connection = get_connection(self.host, self.user, self.password)
+        self._channel = self._connection.channel()
+        # messages are published in transactions, committed once per batch
+        self._channel.tx_select()
+        self._channel.exchange_declare(exchange=self.exchange,
+                                       exchange_type=self.exchange_type,
+                                       durable=True)
+
+    def _close(self):
+        try:
+            if self._connection and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            logger.warning('Fail to close rabbitmq connection', exc_info=True)
+        self._connection = None
+        self._channel = None
@@ -0,0 +1,133 @@
+import os
+import math
+import pickle
+import logging
+
+import redis
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.utils.functional import SimpleLazyObject
+
+logger = logging.getLogger('aves2')
+
+
+class RedisCache(BaseCache):
+    """ Django cache backend on redis
+
+    Django 2.2 has no redis backend. Integers are stored as plain redis
+    strings so that incr() is a single atomic INCRBY, other values are
+    pickled. Can also be set as a CACHES backend with the redis url as
+    LOCATION.
+    """
+    # INCRBY creates missing keys, django's incr() must raise instead
+    INCR_SCRIPT = """
+        if redis.call('exists', KEYS[1]) == 1 then
+            return redis.call('incrby', KEYS[1], ARGV[1])
+        end
+        return nil
+    """
+
+    def __init__(self, location, params):
+        super(RedisCache, self).__init__(params)
+        self.client = redis.Redis.from_url(location)
+        self._incr = self.client.register_script(self.INCR_SCRIPT)
+
+    def _ttl(self, timeout):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else int(math.ceil(timeout))
+
+    def _encode(self, value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value).encode()
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _decode(self, value):
+        try:
+            return int(value)
+        except ValueError:
+            return pickle.loads(value)
+
+    def _key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        ttl = self._ttl(timeout)
+        if ttl is not None and ttl <= 0:
+            return False
+        return bool(self.client.set(self._key(key, version), self._encode(value), ex=ttl, nx=True))
+
+    def get(self, key, default=None, version=None):
+        value = self.client.get(self._key(key, version))
+        return default if value is None else self._decode(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        ttl = self._ttl(timeout)
+        if ttl is not None and ttl <= 0:
+            self.delete(key, version=version)
+            return
+        self.client.set(self._key(key, version), self._encode(value), ex=ttl)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        ttl = self._ttl(timeout)
+        if ttl is None:
+            return bool(self.client.persist(self._key(key, version)))
+        return bool(self.client.expire(self._key(key, version), ttl))
+
+    def delete(self, key, version=None):
+        self.client.delete(self._key(key, version))
+
+    def has_key(self, key, version=None):
+        return bool(self.client.exists(self._key(key, version)))
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([self._key(key, version) for key in keys])
+        return {key: self._decode(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        ttl = self._ttl(timeout)
+        pipe = self.client.pipeline()
+        for key, value in data.items():
+            if ttl is not None and ttl <= 0:
+                pipe.delete(self._key(key, version))
+            else:
+                pipe.set(self._key(key, version), self._encode(value), ex=ttl)
+        pipe.execute()
+        return []
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key, delta=1, version=None):
+        value = self._incr(keys=[self._key(key, version)], args=[delta])
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def clear(self):
+        pattern = self.make_key('*')
+        for key in self.client.scan_iter(match=pattern):
+            self.client.delete(key)
+
+
+def _make_shared_cache():
+    url = getattr(settings, 'AVES_CACHE_URL', os.environ.get('AVES_CACHE_URL'))
+    if url:
+        return RedisCache(url, {})
+    logger.warning('AVES_CACHE_URL is not set, cached job counters and tokens '
+                   'are shared only if the default django cache is')
+    return default_cache
+
+
+# cache of job counters, api tokens and log urls, which have to be the same
+# in every gunicorn and celery process. Redis at AVES_CACHE_URL, else the
+# default django cache.
+cache = SimpleLazyObject(_make_shared_cache)
@@ -8,6 +8,8 @@ from inspect import isfunction
 
 from django.conf import settings
 
+from common_utils.log_stream import LogLines
+
 
 logger = logging.getLogger('aves2')
 
@@ -56,6 +58,9 @@ class DockerClient(object):
     def delete_configs(self, config_name_prefix):
         configs = self.client.configs.list(filters={'name': config_name_prefix})
         for config in configs:
+            # name filter matches substrings, eg. job1-xx matches job11-xx
+            if not config.name.startswith('{0}-'.format(config_name_prefix)):
+                continue
             config.remove()
         return True, None
 
@@ -101,6 +106,28 @@ class DockerClient(object):
             return result, None
         return 'Not found', None
 
+    @handle_api_exception
+    def stream_container_log(self, service_name, follow=False, since_seconds=None,
+                             tail_lines=None, limit_bytes=None, timestamps=True):
+        """ Stream container log of a service line by line
+
+        :return: [generator of log lines, errmsg]
+        """
+        services = self.client.services.list(filters=dict(name=service_name))
+        for service in services:
+            if service.name != service_name:
+                continue
+            container_id = service.tasks()[0]['Status']['ContainerStatus']['ContainerID']
+            container = self.client.containers.get(container_id)
+            kwargs = dict(stream=True, follow=follow, timestamps=timestamps,
+                          tail=tail_lines if tail_lines is not None else 'all')
+            if since_seconds is not None:
+                kwargs['since'] = int(time.time() - since_seconds)
+            stream = container.logs(**kwargs)
+            # CancellableStream.close shuts the socket down, so it aborts a blocked read too
+            return LogLines(stream, limit_bytes=limit_bytes, on_close=stream.close, on_abort=stream.close), None
+        return None, 'Not found'
+
     @handle_api_exception
     def get_container_status(self, service_name):
         services = self.client.services.list(filters=dict(name=service_name))
@@ -0,0 +1,20 @@
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from job_manager.utils.token_cache import get_token_user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ Token authentication backed by the token cache
+
+    Used by the actions called back by workers, which would otherwise look
+    up the token in the db on every call.
+    """
+    def authenticate_credentials(self, key):
+        item = get_token_user(key)
+        if item is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        user, token = item
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return (user, token)
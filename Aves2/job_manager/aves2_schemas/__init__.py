@@ -1,39 +1,58 @@
 import os
 import re
+import copy
 
-from jsonschema import validate
+from jsonschema import Draft7Validator
 
 from .job_schema import job_schema
 from .data_schema import data_schema
 from .worker_schema import worker_schema
 
 
-def validate_job(job):
-    try:
-        validate(instance=job, schema=job_schema)
+def _strip_ids(schema):
+    """ Copy of a schema without $id/$schema, which would change the base uri
+    of $ref once it is embedded into another schema
+    """
+    if isinstance(schema, dict):
+        return {k: _strip_ids(v) for k, v in schema.items() if k not in ('$id', '$schema')}
+    if isinstance(schema, list):
+        return [_strip_ids(v) for v in schema]
+    return schema
+
 
-        # validate codeSpec
-        data = job['codeSpec']
-        validate(instance=data, schema=data_schema)
+def _make_composite_schema():
+    """ job_schema with the data and worker specs checked in the same pass
+    """
+    schema = copy.deepcopy(job_schema)
+    schema['definitions'] = {
+        'data': _strip_ids(data_schema),
+        'worker': _strip_ids(worker_schema),
+    }
+    props = schema['properties']
+    props['codeSpec']['allOf'] = [{'$ref': '#/definitions/data'}]
+    props['logDir']['allOf'] = [{'$ref': '#/definitions/data'}]
+    props['inputSpec']['additionalProperties'] = {'$ref': '#/definitions/data'}
+    props['outputSpec']['additionalProperties'] = {'$ref': '#/definitions/data'}
+    props['resourceSpec']['additionalProperties'] = {'$ref': '#/definitions/worker'}
+    return schema
 
-        # validate inputSpec
-        for key, data in job['inputSpec'].items():
-            validate(instance=data, schema=data_schema)
 
-        # validate outputSpec
-        for key, data in job['inputSpec'].items():
-            validate(instance=data, schema=data_schema)
+job_composite_schema = _make_composite_schema()
+Draft7Validator.check_schema(job_composite_schema)
+job_validator = Draft7Validator(job_composite_schema)
 
-        # validate logDir
-        data = job['logDir']
-        validate(instance=data, schema=data_schema)
 
-        # validate resourceSpec
-        for key, data in job['resourceSpec'].items():
-            validate(instance=data, schema=worker_schema)
+def validate_job(job):
+    """ Validate a submitted job and all its specs in one pass
+
+    :return: (True, '') or (False, err_msg) with the errors of all fields
+    """
+    errors = sorted(job_validator.iter_errors(job), key=lambda e: list(e.absolute_path))
+    if not errors:
         return True, ''
-    except Exception as e:
-        return False, e
+    err_msg = '; '.join('{0}: {1}'.format('/'.join(str(p) for p in e.absolute_path) or 'job', e.message)
+                        for e in errors)
+    return False, err_msg
 
 
 def trans_job_data(job):
@@ -0,0 +1,160 @@
+import time
+import tracemalloc
+from collections import namedtuple, OrderedDict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from job_manager.models import AvesJob, AvesWorker
+from job_manager.utils.work_builder.base_maker import BaseMaker
+from kubernetes_client.k8s_objects import make_pod
+from docker_client.docker_objects import make_service
+
+# stand-in for docker.models.configs.Config, make_service reads name and id only
+FakeConfig = namedtuple('FakeConfig', ['name', 'id'])
+
+
+def make_fake_job(worker_count, input_count, output_count):
+    """ Build an in-memory avesjob with worker_count workers, nothing is saved
+    """
+    def data_spec(i, prefix):
+        if i % 2:
+            return {'type': 'K8SPVC', 'path': '/{0}/{1}/'.format(prefix, i), 'filename': '', 'pvc': 'pvc-{0}'.format(i)}
+        return {'type': 'OSSFile', 'path': 's3://bench/{0}/{1}/'.format(prefix, i), 'filename': ''}
+
+    avesjob = AvesJob(
+        id=1,
+        name='bench',
+        username='bench',
+        namespace='default',
+        job_id='bench',
+        engine='tensorflow',
+        is_distribute=worker_count > 1,
+        distribute_type='HOROVOD' if worker_count > 1 else None,
+        image='bench:latest',
+        resource_spec={'worker': {'count': worker_count, 'cpu': 4, 'memory': '8Gi', 'gpu': 1}},
+        storage_mode='OSSFile',
+        storage_config={'config': {'S3Endpoint': 'http://oss', 'S3AccessKeyId': 'id', 'S3SecretAccessKey': 'key'}},
+        envs={'BENCH_ENV_{0}'.format(i): str(i) for i in range(10)},
+        code_spec=data_spec(0, 'src'),
+        input_spec={'input{0}'.format(i): data_spec(i, 'input') for i in range(input_count)},
+        output_spec={'output{0}'.format(i): data_spec(i, 'output') for i in range(output_count)},
+        log_dir=data_spec(0, 'log'),
+    )
+    # skip the token lookup in AvesJob.api_token
+    avesjob._token = 'bench-token'
+
+    workers = []
+    for i in range(worker_count):
+        workers.append(AvesWorker(
+            id=i + 1,
+            username=avesjob.username,
+            namespace=avesjob.namespace,
+            engine=avesjob.engine,
+            avesjob=avesjob,
+            worker_name=avesjob._make_aves_worker_name('worker', i),
+            is_main_node=(i == 0),
+            avesrole='worker',
+            role_index=i,
+            cpu_request=4,
+            cpu_limit=4,
+            mem_request=8,
+            mem_limit=8,
+            gpu_request=1,
+            entrypoint='python train.py',
+            args=[{'epochs': 10}, {'batch_size': 32}],
+        ))
+    return avesjob, workers
+
+
+class Command(BaseCommand):
+    help = 'Benchmark manifest generation (BaseMaker, make_pod, make_service) without a cluster'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 10, 100, 1000],
+                            help='worker counts of the synthetic jobs')
+        parser.add_argument('--inputs', type=int, default=8, help='input specs per job')
+        parser.add_argument('--outputs', type=int, default=4, help='output specs per job')
+        parser.add_argument('--repeat', type=int, default=3, help='best of N runs')
+
+    def _run_stages(self, avesjob, workers, stats, trace=False):
+        def measure(stage, fn, *args):
+            if trace:
+                # reset current/peak counters to measure this stage only
+                tracemalloc.clear_traces()
+            start = time.perf_counter()
+            rt = fn(*args)
+            elapsed = time.perf_counter() - start
+            if trace:
+                retained, peak = tracemalloc.get_traced_memory()
+                stats[stage]['alloc'] += retained
+                stats[stage]['peak'] = max(stats[stage]['peak'], peak)
+            else:
+                stats[stage]['time'] += elapsed
+            return rt
+
+        m = BaseMaker(avesjob, None)
+        configname, data = measure('gen_confdata_aves_scripts', m.gen_confdata_aves_scripts)
+        configs = [FakeConfig('{0}-{1}'.format(configname, k), k) for k in data]
+
+        for worker in workers:
+            m = measure('BaseMaker', BaseMaker, avesjob, worker)
+            envs = measure('gen_envs', m.gen_envs)
+            volumes = measure('gen_volumes', m.gen_volumes)
+            mounts = measure('gen_volume_mounts', m.gen_volume_mounts)
+            args = measure('gen_args', m.gen_args)
+            labels = m.gen_pod_labels()
+            kwargs = dict(
+                cpu_limit=worker.cpu_request,
+                cpu_guarantee=worker.cpu_limit,
+                mem_limit='{mem}Gi'.format(mem=worker.mem_request),
+                mem_guarantee='{mem}Gi'.format(mem=worker.mem_limit),
+                gpu_limit=worker.gpu_request,
+                gpu_guarantee=worker.gpu_request,
+            )
+            measure('make_pod', lambda: make_pod(
+                name=worker.worker_name, cmd=m.gen_command(), args=args, image=m.gen_image(),
+                env=envs, labels=labels, port_list=[], volumes=volumes, volume_mounts=mounts, **kwargs))
+            measure('make_service', lambda: make_service(
+                name=worker.worker_name, cmd=m.gen_command(), cmd_args=args, image=m.gen_image(),
+                env=envs, networks=['bench'], labels=labels, port_list=[], configs=configs,
+                volumes=volumes, volume_mounts=mounts, **kwargs))
+
+        if settings.ENABLE_K8S:
+            # pods of a k8s job: one template per worker spec, cloned per worker
+            templates = measure('pod_template', avesjob.build_pod_templates, workers)
+            for worker in workers:
+                measure('pod_template', worker.clone_pod_manifest, templates[worker.pod_template_key])
+
+    def handle(self, *args, **options):
+        stages = ['BaseMaker', 'gen_envs', 'gen_volumes', 'gen_volume_mounts', 'gen_args',
+                  'gen_confdata_aves_scripts', 'make_pod', 'pod_template', 'make_service']
+        header = '{0:>8} {1:<26} {2:>12} {3:>14} {4:>13} {5:>12}'.format(
+                    'workers', 'stage', 'total(ms)', 'per worker(us)', 'retained(KiB)', 'peak(KiB)')
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+
+        for worker_count in options['workers']:
+            avesjob, workers = make_fake_job(worker_count, options['inputs'], options['outputs'])
+
+            best = None
+            for _ in range(options['repeat']):
+                stats = OrderedDict((s, {'time': 0.0, 'alloc': 0, 'peak': 0}) for s in stages)
+                self._run_stages(avesjob, workers, stats)
+                if best is None or sum(v['time'] for v in stats.values()) < sum(v['time'] for v in best.values()):
+                    best = stats
+
+            tracemalloc.start()
+            try:
+                self._run_stages(avesjob, workers, best, trace=True)
+            finally:
+                tracemalloc.stop()
+
+            for stage, v in best.items():
+                self.stdout.write('{0:>8} {1:<26} {2:>12.2f} {3:>14.1f} {4:>13.1f} {5:>12.1f}'.format(
+                    worker_count, stage, v['time'] * 1000, v['time'] * 1e6 / worker_count,
+                    v['alloc'] / 1024.0, v['peak'] / 1024.0))
+            total = sum(v['time'] for v in best.values())
+            self.stdout.write('{0:>8} {1:<26} {2:>12.2f} {3:>14.1f}'.format(
+                worker_count, 'total', total * 1000, total * 1e6 / worker_count))
+            self.stdout.write('')
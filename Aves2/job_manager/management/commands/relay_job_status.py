@@ -0,0 +1,53 @@
+import sys
+import json
+import time
+import signal
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from job_manager.models import JobStatusReport
+from common_utils.rabbitmq import BatchPublisher
+
+logger = logging.getLogger('cmd')
+
+
+def quit_handler(signum, frame):
+    sys.exit(0)
+
+
+class Command(BaseCommand):
+    help = 'Publish job status reports from the outbox table to rabbitmq'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=1,
+                            help='seconds to sleep when the outbox is empty')
+
+    def handle(self, *args, **options):
+        signal.signal(signal.SIGABRT, quit_handler)
+        signal.signal(signal.SIGINT, quit_handler)
+        signal.signal(signal.SIGTERM, quit_handler)
+
+        # a single relay process keeps reports in the order they are written
+        publisher = BatchPublisher(
+                        settings.RABBITMQ_HOST,
+                        settings.RABBITMQ_USER,
+                        settings.RABBITMQ_PASS,
+                        settings.STATUS_REPORT_EXCHANGE,
+                        settings.STATUS_REPORT_EXCHANGE_TYPE,
+                        settings.STATUS_REPORT_ROUTING_KEY)
+        while True:
+            reports = list(JobStatusReport.objects.order_by('id')[:options['batch_size']])
+            if not reports:
+                publisher.keepalive()
+                time.sleep(options['interval'])
+                continue
+
+            bodies = [json.dumps(r.to_report()) for r in reports]
+            sent = publisher.publish_batch(bodies)
+            if sent:
+                JobStatusReport.objects.filter(id__in=[r.id for r in reports[:sent]]).delete()
+            if sent < len(reports):
+                time.sleep(options['interval'])
@@ -41,15 +41,17 @@ class Command(BaseCommand):
                         if status:
                             if status[0].get('Status', {}).get('State', '') == 'rejected':
                                 err_msg = status[0].get('Status', {}).get('Err', '')
-                                job.all_workers.update(k8s_status=WorkerStatus.FAILURE)
                                 logger.info(f'{job} failed: {worker} msg: {err}')
-                                job.update_status(JobStatus.FAILURE, msg=err_msg)
-                                job.clean_work(force=True)
+                                if job.transition_status(JobStatus.FAILURE, msg=err_msg,
+                                                         from_statuses=[JobStatus.STARTING, JobStatus.RUNNING]):
+                                    job.update_all_workers_status(WorkerStatus.FAILURE)
+                                    job.clean_work(force=True)
                                 break
                         elif status == []:
                             logger.info(f'{job} failed: workers are disappeared')
-                            job.all_workers.update(k8s_status=WorkerStatus.FAILURE)
-                            job.update_status(JobStatus.FAILURE, msg='workers are disappeared')
-                            job.clean_work(force=True)
+                            if job.transition_status(JobStatus.FAILURE, msg='workers are disappeared',
+                                                     from_statuses=[JobStatus.STARTING, JobStatus.RUNNING]):
+                                job.update_all_workers_status(WorkerStatus.FAILURE)
+                                job.clean_work(force=True)
                             break
             time.sleep(60*5)
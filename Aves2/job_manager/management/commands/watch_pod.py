@@ -1,9 +1,12 @@
+import os
+import re
 import sys
+import zlib
 import signal
-import pickle
-import pika
 import time
 import logging
+import threading
+from collections import OrderedDict
 from inspect import isfunction
 from operator import itemgetter
 
@@ -12,6 +15,7 @@ from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
 from job_manager import tasks
+from kubernetes_client import pod_event_summary
 
 logger = logging.getLogger('cmd')
 
@@ -20,9 +24,134 @@ def quit_handler(signum, frame):
     sys.exit(0)
 
 
+def default_shard_index():
+    """ Shard index from env, or from the ordinal of a statefulset pod name
+    """
+    if os.environ.get('AVES_WATCHER_SHARD_INDEX'):
+        return int(os.environ['AVES_WATCHER_SHARD_INDEX'])
+    match = re.match(r'.*-(\d+)$', os.environ.get('HOSTNAME', ''))
+    return int(match.group(1)) if match else 0
+
+
+class PodEventCoalescer(object):
+    """ Collapse pod events before they are sent to celery
+
+    Events are buffered per pod for `window` seconds and only the latest one
+    is sent. A pod whose (phase, waiting reason) equals the last state sent
+    for it is dropped, so MODIFIED events for status churn that aves2 does
+    not react on (conditions, ip, restarts) never become celery tasks. A
+    DELETED event replaces the pending event of its pod, so a final phase
+    reached just before deletion is still sent.
+    """
+    def __init__(self, send, window=1.0):
+        self.send = send
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # (namespace, pod_name) -> event dict
+        self._last_sent = {}           # (namespace, pod_name) -> state
+
+    @staticmethod
+    def _state(event):
+        return (event['phase'], event['waiting_reason'])
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='aves-event-coalescer')
+        thread.daemon = True
+        thread.start()
+
+    def add(self, event):
+        key = (event['namespace'], event['pod_name'])
+        with self._lock:
+            if event['type'] == 'DELETED':
+                # the deleted pod carries its final phase, which may not
+                # have been sent yet (e.g. Failed then deleted in the window)
+                if key in self._pending or self._last_sent.get(key) != self._state(event):
+                    self._pending.pop(key, None)
+                    self._pending[key] = event
+                else:
+                    self._last_sent.pop(key, None)
+            elif self._last_sent.get(key) == self._state(event):
+                # back to the state already sent, pending changes cancel out
+                self._pending.pop(key, None)
+            else:
+                self._pending.pop(key, None)
+                self._pending[key] = event
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        for key, event in pending.items():
+            try:
+                self.send(event)
+            except Exception:
+                logger.error(f'fail to send pod event {event}', exc_info=True)
+                continue
+            with self._lock:
+                if event['type'] == 'DELETED':
+                    self._last_sent.pop(key, None)
+                else:
+                    self._last_sent[key] = self._state(event)
+
+    def _run(self):
+        while True:
+            time.sleep(self.window)
+            try:
+                self.flush()
+            except Exception:
+                logger.error('fail to flush pod events', exc_info=True)
+
+
 class Command(BaseCommand):
     help = 'Watch k8s pod event'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int,
+                            default=int(os.environ.get('AVES_WATCHER_SHARDS', 1)),
+                            help='number of watcher replicas')
+        parser.add_argument('--shard-index', type=int, default=default_shard_index(),
+                            help='index of this replica, in [0, shards)')
+        parser.add_argument('--shard-by', choices=['job', 'namespace'],
+                            default=os.environ.get('AVES_WATCHER_SHARD_BY', 'job'),
+                            help='shard pods by hash of avesJobId or of namespace')
+        parser.add_argument('--timeout', type=int, default=300,
+                            help='seconds before the watch call is renewed')
+        parser.add_argument('--coalesce-window', type=float,
+                            default=getattr(settings, 'AVES_WATCHER_COALESCE_WINDOW', 1.0),
+                            help='seconds pod events are buffered before sent')
+
+    def is_own_pod(self, pod):
+        if self.shards <= 1:
+            return True
+        if self.shard_by == 'namespace':
+            key = pod.metadata.namespace or ''
+        else:
+            key = (pod.metadata.labels or {}).get('avesJobId', '')
+        return zlib.crc32(key.encode('utf-8')) % self.shards == self.shard_index
+
+    def dispatch(self, event):
+        event_type = event.get('type')
+        pod = event['object']
+        logger.info(f"receive pod event type:{event_type} pod_name:{pod.metadata.name} phase:{pod.status.phase}")
+
+        if event_type not in ['MODIFIED', 'ADDED', 'DELETED']:
+            return
+        self.coalescer.add(pod_event_summary(event_type, pod))
+
+    def send(self, event):
+        tasks.process_k8s_pod_event.apply_async((event,), serializer='json')
+
+    def list_pods(self, api, label):
+        """ List current pods and dispatch them as ADDED events
+
+        Only called on start and when the watch resourceVersion is expired,
+        reconnects resume from the last seen resourceVersion instead.
+        """
+        resp = api.list_pod_for_all_namespaces(label_selector=label)
+        for pod in resp.items:
+            if self.is_own_pod(pod):
+                self.dispatch({'type': 'ADDED', 'object': pod})
+        return resp.metadata.resource_version
+
     def handle(self, *args, **options):
         signal.signal(signal.SIGABRT, quit_handler)
         signal.signal(signal.SIGINT, quit_handler)
@@ -31,31 +160,44 @@ class Command(BaseCommand):
         if settings.AVES2_CLUSTER != "k8s":
             raise Exception('k8s cluster is required')
 
+        self.shards = options['shards']
+        self.shard_index = options['shard_index']
+        self.shard_by = options['shard_by']
+        if not 0 <= self.shard_index < self.shards:
+            raise CommandError(f'invalid shard index {self.shard_index} of {self.shards} shards')
+        logger.info(f'watch pods: shard {self.shard_index}/{self.shards} by {self.shard_by}')
+
+        self.coalescer = PodEventCoalescer(self.send, window=options['coalesce_window'])
+        self.coalescer.start()
+
         api = client.CoreV1Api()
-        watcher = watch.Watch()
         label = f'app={settings.AVES_JOB_LABEL}'
+        stream_kwargs = dict(label_selector=label, timeout_seconds=options['timeout'])
+        # watch bookmarks require kubernetes client >= 11 and k8s >= 1.15
+        if getattr(settings, 'AVES_WATCH_BOOKMARKS', False):
+            stream_kwargs['allow_watch_bookmarks'] = True
+
+        resource_version = None
         while True:
             try:
+                if resource_version is None:
+                    resource_version = self.list_pods(api, label)
+
+                watcher = watch.Watch()
                 for event in watcher.stream(
                                 api.list_pod_for_all_namespaces,
-                                label_selector=label,
-                                pretty=True, watch=True):
-                    event_type = event.get('type')
-                    pod = event['object']
-                    pod_name = pod.metadata.name
-                    phase = pod.status.phase
-
-                    logger.info(f"receive pod event type:{event_type} pod_name:{pod_name} phase:{phase}")
-                    if event['object'].status.conditions:
-                        event['object'].status.conditions = sorted(event['object'].status.conditions, key=lambda x: x.last_transition_time)
-
-                    if event_type not in ['MODIFIED', 'ADDED']:
+                                resource_version=resource_version,
+                                **stream_kwargs):
+                    if event['type'] == 'ERROR':
+                        # 410 Gone: resourceVersion is too old, relist
+                        logger.info(f"watch error: {event['raw_object']}")
+                        resource_version = None
+                        break
+                    resource_version = event['object'].metadata.resource_version
+                    if event['type'] == 'BOOKMARK':
                         continue
-                    try:
-                        tasks.process_k8s_pod_event.apply_async(
-                                (event,),
-                                serializer='pickle')
-                    except Exception as e:
-                        self.stdout.write(str(e))
+                    if self.is_own_pod(event['object']):
+                        self.dispatch(event)
             except Exception:
-                pass
+                logger.error('watch pod stream broken, resume later', exc_info=True)
+                time.sleep(5)
@@ -0,0 +1,26 @@
+# Generated by Django 2.2 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('job_manager', '0002_avesjob_msg'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobStatusReport',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('job_id', models.CharField(max_length=128)),
+                ('status', models.CharField(max_length=16)),
+                ('msg', models.CharField(blank=True, default='', max_length=512)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'avesjob_status_report',
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2 on 2026-10-18 12:00
+
+from django.db import migrations
+import django_mysql.models
+import job_manager.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('job_manager', '0003_jobstatusreport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='avesjob',
+            name='worker_status_count',
+            field=django_mysql.models.JSONField(blank=True, default=job_manager.models.json_field_default),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('job_manager', '0004_avesjob_worker_status_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='avesjob',
+            index=models.Index(fields=['username', '-id'], name='avesjob_username_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='avesjob',
+            index=models.Index(fields=['namespace', 'status', '-id'], name='avesjob_ns_status_id_idx'),
+        ),
+    ]
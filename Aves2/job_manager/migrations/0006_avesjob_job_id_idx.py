@@ -0,0 +1,17 @@
+# Generated by Django 2.2 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('job_manager', '0005_avesjob_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='avesjob',
+            index=models.Index(fields=['job_id'], name='avesjob_job_id_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('job_manager', '0006_avesjob_job_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobOperation',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('operation_id', models.CharField(max_length=64, unique=True)),
+                ('operation', models.CharField(max_length=16)),
+                ('job_id', models.IntegerField()),
+                ('username', models.CharField(max_length=128)),
+                ('create_time', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'avesjob_operation',
+            },
+        ),
+    ]
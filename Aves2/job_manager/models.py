@@ -4,20 +4,29 @@ import io
 import copy
 import time
 import json
+import calendar
 import logging
 import requests
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django.conf import settings
 from django_mysql.models import JSONField
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 
-from .utils.work_builder.base_maker import BaseMaker
+from common_utils.shared_cache import cache
+from .utils.work_builder.base_maker import BaseMaker, scripts_configname, worker_status_report_url
+from .utils.log_archive import get_log_archive
+from .utils.job_counter import incr_job_count
+from .utils.token_cache import get_user_token
 
 if settings.ENABLE_K8S:
-    from kubernetes_client.k8s_objects import make_pod, make_configmap
+    from kubernetes_client.k8s_objects import make_pod, clone_pod, make_configmap
     from kubernetes_client.client import k8s_client
 else:
     from docker_client.docker_objects import make_config_datas, make_service
@@ -26,6 +35,9 @@ else:
 logger = logging.getLogger('aves2')
 
 
+_TIMESTAMP_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2})[\sT](\d{2}:\d{2}:\d{2})(\.\d+)?(Z?)')
+
+
 def json_field_default():
     return {}
 
@@ -34,6 +46,17 @@ def json_field_default_list():
     return []
 
 
+def _close_db_connection(fn):
+    """ Close the thread local db connection once fn is done in a pool thread
+    """
+    def fn_wrap(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            connection.close()
+    return fn_wrap
+
+
 class JobStatus:
     NEW = 'NEW'
     STARTING = 'STARTING'
@@ -94,6 +117,8 @@ class AvesJob(models.Model):
     need_report = models.BooleanField(blank=True, null=False, default=False)
     token = models.CharField(max_length=16, blank=True, null=False, default='')
     msg = models.CharField(max_length=512, blank=True, null=False, default='')
+    # number of workers in each status, maintained by AvesWorker.update_status
+    worker_status_count = JSONField(blank=True, null=False, default=json_field_default)
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
 
@@ -108,16 +133,8 @@ class AvesJob(models.Model):
 
     @property
     def api_token(self):
-        if not hasattr(self, '_user'):
-            user = User.objects.get(username=self.username)
-            setattr(self, '_user', user)
         if not hasattr(self, '_token'):
-            try:
-                token = Token.objects.get(user=self._user).key
-                setattr(self, '_token', token)
-            except Exception as e:
-                token = Token.objects.create(user=self._user).key
-                setattr(self, '_token', token)
+            setattr(self, '_token', get_user_token(self.username))
         return self._token
 
     @property
@@ -131,11 +148,11 @@ class AvesJob(models.Model):
     def _make_aves_worker_name(self, role, role_index):
         return '{0}-{1}-{2}'.format(self.merged_id, role, role_index)
 
-    def make_aves_workers(self):
-        if self.aves_worker.count() > 0:
-            logger.error('{0}: Fail to make aves workers, already exist'.format(self))
-            raise Exception('Not Allowed')
+    def build_aves_workers(self):
+        """ Build the workers of resource_spec, nothing is saved
 
+        :return: [AvesWorker]
+        """
         aves_workers = []
         no_master_role = True if 'master' not in self.resource_spec.keys() else False
         no_ps_role = True if 'ps' not in self.resource_spec.keys() else False
@@ -167,20 +184,170 @@ class AvesJob(models.Model):
                     args=spec.get('args', [])
                 )
                 aves_workers.append(worker)
-        AvesWorker.objects.bulk_create(aves_workers)
+        return aves_workers
 
-    def update_status(self, status, msg=''):
-        from .tasks import report_avesjob_status
+    def make_aves_workers(self):
+        if self.aves_worker.count() > 0:
+            logger.error('{0}: Fail to make aves workers, already exist'.format(self))
+            raise Exception('Not Allowed')
+
+        aves_workers = self.build_aves_workers()
+        with transaction.atomic():
+            AvesWorker.objects.bulk_create(aves_workers)
+            self.worker_status_count = {WorkerStatus.NEW: len(aves_workers)}
+            AvesJob.objects.filter(id=self.id).update(worker_status_count=self.worker_status_count)
+
+    @classmethod
+    def bulk_create_with_workers(cls, avesjobs):
+        """ Insert jobs whose job_id does not exist yet, with their workers
+
+        If the insert of the whole list fails, jobs are inserted one by one,
+        so one bad job does not fail the others.
+
+        :param avesjobs: unsaved AvesJob list, job_id must be unique in the list
+        :return: {job_id: (id, created, err_msg)}, id is the existing job
+                 when the job_id has been submitted already
+        """
+        if not avesjobs:
+            return {}
+        for avesjob in avesjobs:
+            worker_count = sum(int(spec.get('count', 1)) for spec in avesjob.resource_spec.values())
+            avesjob.worker_status_count = {WorkerStatus.NEW: worker_count}
+        results = {}
+        try:
+            results.update(cls._insert_with_workers(avesjobs))
+        except Exception:
+            logger.warning('Fail to bulk insert {0} jobs, insert one by one'.format(len(avesjobs)),
+                           exc_info=True)
+            for avesjob in avesjobs:
+                avesjob.id = None
+                try:
+                    results.update(cls._insert_with_workers([avesjob]))
+                except Exception:
+                    logger.error('Fail to insert job {0}'.format(avesjob.job_id), exc_info=True)
+                    avesjob.id = None
+                    results[avesjob.job_id] = (None, False, 'fail to save job')
+        for avesjob in avesjobs:
+            if results[avesjob.job_id][1]:
+                # bulk_create sends no post_save
+                incr_job_count(avesjob.username, avesjob.status)
+        return results
+
+    @classmethod
+    def _insert_with_workers(cls, avesjobs):
+        """ Insert jobs and their workers in one transaction, skipping the
+        job_ids which exist already
+
+        The job_ids are read with select_for_update first. On mysql this
+        locks the job_id index range even for missing rows, so a concurrent
+        submission of the same job_id waits for this one (or fails on a
+        deadlock and is retried one by one) and then sees the job.
+
+        :return: {job_id: (id, created, None)}
+        """
+        job_ids = [j.job_id for j in avesjobs]
+        with transaction.atomic():
+            existing = dict(cls.objects.select_for_update()
+                                       .filter(job_id__in=job_ids)
+                                       .values_list('job_id', 'id'))
+            new_jobs = [j for j in avesjobs if j.job_id not in existing]
+            if new_jobs:
+                cls.objects.bulk_create(new_jobs)
+                if new_jobs[0].id is None:
+                    # ids are not returned by bulk insert on mysql, read them back by job_id
+                    ids = dict(cls.objects.filter(job_id__in=[j.job_id for j in new_jobs])
+                                          .values_list('job_id', 'id').order_by('id'))
+                    for avesjob in new_jobs:
+                        avesjob.id = ids[avesjob.job_id]
+                aves_workers = []
+                for avesjob in new_jobs:
+                    aves_workers.extend(avesjob.build_aves_workers())
+                AvesWorker.objects.bulk_create(aves_workers)
+        results = dict((job_id, (pk, False, None)) for job_id, pk in existing.items())
+        results.update((j.job_id, (j.id, True, None)) for j in new_jobs)
+        return results
+
+    def active_worker_count(self, worker_status_count=None):
+        """ Number of workers in STARTING or RUNNING status
+
+        :param worker_status_count: counters returned by AvesWorker.update_status,
+                                    defaults to the counters of this instance
+        """
+        counts = self.worker_status_count if worker_status_count is None else worker_status_count
+        if not counts:
+            # jobs created before worker_status_count was added
+            return self.aves_worker.filter(k8s_status__in=[
+                                    WorkerStatus.STARTING,
+                                    WorkerStatus.RUNNING]).count()
+        return counts.get(WorkerStatus.STARTING, 0) + counts.get(WorkerStatus.RUNNING, 0)
+
+    def update_all_workers_status(self, status):
+        """ Set status of all workers and reset the counters in one transaction
+        """
+        with transaction.atomic():
+            job = AvesJob.objects.select_for_update().only('id').get(id=self.id)
+            worker_count = self.aves_worker.update(k8s_status=status, update_time=timezone.now())
+            self.worker_status_count = {status: worker_count}
+            AvesJob.objects.filter(id=job.id).update(worker_status_count=self.worker_status_count)
+
+    def update_status(self, status, msg='', expected_status=None):
+        """ Change job status with a compare-and-set on the old status
+
+        Only status, msg and update_time are written. If the job needs to be
+        reported, a JobStatusReport is written in the same transaction and
+        published by the relay_job_status command.
+
+        :param expected_status: old status to compare with, defaults to
+                                the status of this instance
+        :return: True if the status is changed, False if the job status
+                 has been changed by others
+        """
+        expected_status = self.status if expected_status is None else expected_status
+        msg = msg[:512]
+        now = timezone.now()
+        with transaction.atomic():
+            updated = AvesJob.objects \
+                        .filter(id=self.id, status=expected_status) \
+                        .update(status=status, msg=msg, update_time=now)
+            if not updated:
+                logger.warning(f'Job status not changed: {self}, {expected_status} -> {status}, '
+                               f'status has been changed by others')
+                return False
+            if self.need_report:
+                JobStatusReport.objects.create(job_id=self.job_id, status=status, msg=msg)
         logger.info(f'Job status changed: {self}, {status}, {msg}')
+        if status != expected_status:
+            incr_job_count(self.username, expected_status, -1)
+            incr_job_count(self.username, status)
         self.status = status
         self.msg = msg
-        self.save()
-        if self.need_report:
-            report_avesjob_status.apply_async((self.job_id, status, msg))
+        self.update_time = now
+        return True
+
+    def transition_status(self, status, msg='', from_statuses=None, retries=3):
+        """ update_status against the latest status in db, retried while the
+        status is changed by others (e.g. pod events) in between
+
+        :param from_statuses: statuses the job may leave, None for any
+        :return: True if the status is changed, False otherwise
+        """
+        for _ in range(retries):
+            self.refresh_from_db(fields=['status'])
+            if from_statuses is not None and self.status not in from_statuses:
+                logger.warning(f'{self}: status not changed to {status}, job is {self.status}')
+                return False
+            if self.update_status(status, msg):
+                return True
+        logger.error(f'{self}: fail to change status to {status}, status keeps being changed')
+        return False
 
     def start(self):
         """ Start aves job
 
+        Workers are started concurrently by a bounded thread pool
+        (AVES_WORKER_START_CONCURRENCY). If any worker fails to start, the
+        workers already started are stopped again.
+
         :return: (True/False, err_msg)
         """
         if self.aves_worker.count() == 0:
@@ -191,29 +358,275 @@ class AvesJob(models.Model):
                 logger.error('fail to create aves workers', exc_info=True)
                 return False, err
 
-        for worker_i in self.aves_worker.all():
-            pod, err = worker_i.start()
-            if err:
-                return False, err
+        workers = list(self.aves_worker.all())
+        for worker_i in workers:
+            worker_i.avesjob = self
+        # get or create the api token once, before workers read it concurrently
+        self.api_token
+
+        pod_templates = {}
+        if settings.ENABLE_K8S:
+            try:
+                pod_templates = self.build_pod_templates(workers)
+            except Exception:
+                logger.error('{0}: Fail to build pod templates'.format(self), exc_info=True)
+                return False, 'Fail to build worker pods'
+
+        scripts_configs, err = self._create_scripts_config()
+        if not scripts_configs:
+            logger.error('{0}: Fail to create aves scripts config. {1}'.format(self, err))
+            return False, 'Fail to create aves scripts config'
+
+        pool_size = min(getattr(settings, 'AVES_WORKER_START_CONCURRENCY', 10), len(workers))
+        started = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            futures = {executor.submit(_close_db_connection(w.start), scripts_configs,
+                                       pod_templates.get(w.pod_template_key)): w
+                       for w in workers}
+            for future in as_completed(futures):
+                worker_i = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    rt, err = future.result()
+                except Exception as e:
+                    logger.error('{0}: Fail to start. unhandled exception'.format(worker_i), exc_info=True)
+                    rt, err = None, 'Fail to start worker {0}'.format(worker_i.worker_name)
+                if rt:
+                    started.append(worker_i)
+                    continue
+                errors.append(err or 'Fail to start worker {0}'.format(worker_i.worker_name))
+                # stop launching the workers not started yet
+                for f in futures:
+                    f.cancel()
+
+            if errors:
+                logger.error('{0}: Fail to start workers: {1}. rollback {2} started workers'
+                             .format(self, errors, len(started)))
+                for _ in executor.map(_close_db_connection(lambda w: w.stop()), started):
+                    pass
+                # leave STARTING, so the worker counters of the job stay right
+                for worker_i in started:
+                    worker_i.update_status(WorkerStatus.CANCELED)
+                self._delete_scripts_config()
+                return False, '; '.join(errors)
         return True, None
 
+    def build_pod_templates(self, workers):
+        """ Build one pod per distinct worker spec, usually one per role.
+        Workers clone the pod of their spec instead of building their own.
+
+        :return: {pod_template_key: V1Pod}
+        """
+        templates = {}
+        for worker in workers:
+            key = worker.pod_template_key
+            if key not in templates:
+                templates[key] = worker.make_pod_manifest()
+        return templates
+
     def cancel(self):
         """ Cancel avesjob and del related k8s/docker resources
 
+        All workers are torn down even if some of them fail. Logs are
+        archived first and workers still active are marked CANCELED, so
+        their logs are served from the archive afterwards.
+
         :return: (True/False, err_msg)
         """
-        for worker_i in self.aves_worker.all():
-            rt = worker_i.stop()
-            if not rt:
-                return False, '{0}: Fail to stop work {1}'.format(self, worker_i)
+        workers = list(self.aves_worker.all())
+        self.archive_worker_logs(workers)
+        results = self.teardown(workers)
+        for worker_i in workers:
+            if worker_i.k8s_status in [WorkerStatus.NEW, WorkerStatus.STARTING,
+                                       WorkerStatus.PENDING, WorkerStatus.RUNNING]:
+                worker_i.update_status(WorkerStatus.CANCELED)
+        errors = ['{0}: {1}'.format(w, err) for w, (ok, err) in results.items() if not ok]
+        if errors:
+            return False, '{0}: Fail to stop workers. {1}'.format(self, '; '.join(errors))
         return True, None
 
     def clean_work(self, force=False):
         logger.info('{0}: clean job. job workers will be cleaned'.format(self))
+        keep_worker = None
+        workers = []
         for worker_i in self.aves_worker.all():
             if self.debug == True and worker_i.is_main_node and force == False:
+                keep_worker = worker_i
                 continue
-            worker_i.stop()
+            workers.append(worker_i)
+        self.archive_worker_logs(workers)
+        self.teardown(workers, keep_worker=keep_worker)
+
+    def teardown(self, workers, keep_worker=None):
+        """ Delete pods/services of workers and the job scoped scripts config
+
+        On k8s all pods of the job are deleted by one label selector call,
+        on swarm services are removed concurrently. Nothing is rendered.
+
+        :param workers: workers to stop, all workers of the job but keep_worker
+        :param keep_worker: worker left running, the scripts config is kept for it
+        :return: {worker: (True/False, err_msg)}
+        """
+        if settings.ENABLE_K8S:
+            results = self._kube_teardown(workers, keep_worker)
+        else:
+            results = self._swarm_teardown(workers, keep_worker)
+        for worker_i, (ok, err) in results.items():
+            if not ok:
+                logger.error('{0}: Fail to stop worker {1}. {2}'.format(self, worker_i, err))
+        return results
+
+    def _kube_teardown(self, workers, keep_worker):
+        label_selector = 'avesJobId={0}'.format(self.id)
+        if keep_worker is not None:
+            label_selector += ',workerId!={0}'.format(keep_worker.id)
+        pods, _ = k8s_client.get_job_pod_list(self.namespace, self.id)
+        pod_worker_ids = set((pod.metadata.labels or {}).get('workerId') for pod in pods or [])
+
+        logger.info('{0}: delete job pods {1}'.format(self, label_selector))
+        _, err = k8s_client.delete_collection_namespaced_pod(self.namespace, label_selector)
+        if keep_worker is None:
+            k8s_client.delete_collection_namespaced_configmap(
+                    self.namespace, 'avesJobId={0}'.format(self.id))
+
+        results = {}
+        for worker_i in workers:
+            if err:
+                results[worker_i] = (False, err)
+            elif str(worker_i.id) not in pod_worker_ids:
+                results[worker_i] = (True, 'pod not found')
+            else:
+                results[worker_i] = (True, None)
+        return results
+
+    def _swarm_teardown(self, workers, keep_worker):
+        results = {}
+        if workers:
+            concurrency = getattr(settings, 'AVES_WORKER_STOP_CONCURRENCY', 10)
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(workers))) as executor:
+                futures = {executor.submit(doc_client.delete_service, w.worker_name): w for w in workers}
+                for future in as_completed(futures):
+                    rt, err = future.result()
+                    results[futures[future]] = (bool(rt), err)
+        if keep_worker is None:
+            # configs in use by a service can not be removed, so after the services
+            doc_client.delete_configs(scripts_configname(self.id))
+        return results
+
+    def get_worker_log_urls(self):
+        """ Log urls of all workers, resolved from one pod list
+
+        Pods come from the pod cache or one label-selector list call, the
+        result is cached for AVES_LOG_URL_CACHE_TTL seconds once every pod has
+        its urls.
+
+        :return: {worker_id: (readlog_url, loginfo_url)}
+        """
+        cache_key = 'aves2:log_urls:{0}'.format(self.id)
+        log_urls = cache.get(cache_key)
+        if log_urls is not None:
+            return log_urls
+
+        pods, err = k8s_client.get_job_pod_list(self.namespace, self.id)
+        if err:
+            logger.warning('{0}: Fail to list pods. {1}'.format(self, err))
+            return {}
+        log_urls = {}
+        for pod in pods:
+            worker_id = (pod.metadata.labels or {}).get('workerId')
+            urls = AvesWorker.make_log_urls(pod.status)
+            if worker_id and urls:
+                log_urls[int(worker_id)] = urls
+        # containers without an id yet get their urls on the next call
+        if log_urls and len(log_urls) == len(pods):
+            cache.set(cache_key, log_urls, getattr(settings, 'AVES_LOG_URL_CACHE_TTL', 30))
+        return log_urls
+
+    def archive_worker_logs(self, workers):
+        """ Archive logs of workers before they are deleted
+
+        Does nothing unless AVES_LOG_ARCHIVE_DIR is set. A worker failing to
+        be archived does not stop the others.
+        """
+        if not workers or get_log_archive(AvesWorker._extract_timestamp) is None:
+            return
+        concurrency = getattr(settings, 'AVES_LOG_ARCHIVE_CONCURRENCY', 4)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(workers))) as executor:
+            list(executor.map(lambda w: w.archive_log(), workers))
+
+    def _create_scripts_config(self):
+        """ Render aves scripts once and create the job scoped configmap
+        (k8s) or configs (swarm) mounted by all workers
+
+        :return: (configmap or docker configs, err_msg)
+        """
+        m = BaseMaker(self, None)
+        configname, data = m.gen_confdata_aves_scripts()
+        if settings.ENABLE_K8S:
+            configmap = make_configmap(configname, data, labels={'avesJobId': '%s' % self.id})
+            k8s_client.delete_namespaced_configmap(configname, self.namespace)
+            return k8s_client.create_namespaced_configmap(configmap, self.namespace)
+        else:
+            doc_client.delete_configs(configname)
+            return doc_client.create_multiple_configs(make_config_datas(configname, data))
+
+    def _delete_scripts_config(self):
+        configname = scripts_configname(self.id)
+        if settings.ENABLE_K8S:
+            return k8s_client.delete_namespaced_configmap(configname, self.namespace)
+        else:
+            return doc_client.delete_configs(configname)
+
+    def check_workers_ready(self, worker_count=None):
+        """ Check whether all workers are running and have been assigned an ip
+
+        :return: (True/False, err_msg)
+        """
+        if worker_count is None:
+            worker_count = self.aves_worker.count()
+        if settings.ENABLE_K8S:
+            pods, msg = k8s_client.get_job_pod_list(self.namespace, self.id)
+            if pods is None:
+                logger.error('{0}: Fail to get_job_pod_list. msg: {1}'.format(self, msg))
+                return False, 'Fail to get job info'
+            if not len(pods) == worker_count:
+                return False, 'workers are not ready'
+            for pod in pods:
+                if not (pod.status and pod.status.phase == 'Running' and pod.status.pod_ip):
+                    return False, 'worker {0} is not ready'.format(pod.metadata.name)
+        else:
+            containers, msg = doc_client.list_containers(labels={'avesJobId': self.id})
+            if containers is None:
+                logger.error('{0}: Fail to list_containers. msg: {1}'.format(self, msg))
+                return False, 'Fail to get job info'
+            if not len(containers) == worker_count:
+                return False, 'workers are not ready'
+            for container in containers:
+                if container.status != 'running':
+                    return False, 'worker {0} is not ready'.format(container.labels.get('workerName'))
+        return True, None
+
+    def wait_workers_ready(self, timeout):
+        """ Block until all workers are ready or timeout
+
+        On k8s the wait is woken up by pod watch events, so the call returns
+        as soon as the last worker gets an ip.
+
+        :return: (True/False, err_msg)
+        """
+        deadline = time.time() + timeout
+        worker_count = self.aves_worker.count()
+        ready, msg = self.check_workers_ready(worker_count)
+        while not ready and time.time() < deadline:
+            remaining = deadline - time.time()
+            if settings.ENABLE_K8S:
+                k8s_client.wait_pod_change(remaining)
+            else:
+                time.sleep(min(remaining, 10))
+            ready, msg = self.check_workers_ready(worker_count)
+        return ready, msg
 
     def get_dist_envs(self):
         if self.distribute_type == 'TF_PS':
@@ -235,7 +648,7 @@ class AvesJob(models.Model):
 
         # TODO: make a better implementation
         if settings.ENABLE_K8S:
-            pods, msg = k8s_client.get_namespaced_pod_list(self.namespace, selector={'avesJobId': self.id})
+            pods, msg = k8s_client.get_job_pod_list(self.namespace, self.id)
             ps_ips = ['{0}:2222'.format(i.status.pod_ip) for i in pods if i.metadata.labels.get('workerId') in ps]
             worker_ips = ['{0}:2222'.format(i.status.pod_ip) for i in pods if i.metadata.labels.get('workerId') in workers]
         else:
@@ -267,7 +680,7 @@ class AvesJob(models.Model):
         hosts = []
         # TODO: make a better implementation
         if settings.ENABLE_K8S:
-            pods, msg = k8s_client.get_namespaced_pod_list(self.namespace, selector={'avesJobId': self.id})
+            pods, msg = k8s_client.get_job_pod_list(self.namespace, self.id)
             pods_map = {int(i.metadata.labels.get('workerId')): i for i in pods}
             for w in all_workers:
                 per_num = w.gpu_request if w.gpu_request else 1
@@ -307,6 +720,68 @@ class AvesJob(models.Model):
 
     class Meta:
         db_table = 'avesjob'
+        indexes = [
+            models.Index(fields=['username', '-id'], name='avesjob_username_id_idx'),
+            models.Index(fields=['namespace', 'status', '-id'], name='avesjob_ns_status_id_idx'),
+            models.Index(fields=['job_id'], name='avesjob_job_id_idx'),
+        ]
+
+
+@receiver(post_save, sender=AvesJob)
+def _count_created_job(sender, instance, created, **kwargs):
+    if created:
+        incr_job_count(instance.username, instance.status)
+
+
+@receiver(post_delete, sender=AvesJob)
+def _count_deleted_job(sender, instance, **kwargs):
+    incr_job_count(instance.username, instance.status, -1)
+
+
+class JobStatusReport(models.Model):
+    """ Outbox of job status reports
+
+    Rows are written together with the status change and deleted by the
+    relay_job_status command once published to rabbitmq.
+    """
+    id = models.AutoField(primary_key=True)
+    job_id = models.CharField(max_length=128, blank=False, null=False)
+    status = models.CharField(max_length=16, blank=False, null=False)
+    msg = models.CharField(max_length=512, blank=True, null=False, default='')
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    def to_report(self):
+        return {
+            'jobId': self.job_id,
+            'status': self.status,
+            'msg': self.msg}
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.job_id, self.status)
+
+    class Meta:
+        db_table = 'avesjob_status_report'
+
+
+class JobOperation(models.Model):
+    """ Owner of a queued lifecycle task
+
+    Shared by every gunicorn process, so that the progress of an operation
+    can be read from any of them. Rows older than AVES_OPERATION_TTL are
+    purged when new operations are registered.
+    """
+    id = models.AutoField(primary_key=True)
+    operation_id = models.CharField(max_length=64, unique=True, blank=False, null=False)
+    operation = models.CharField(max_length=16, blank=False, null=False)
+    job_id = models.IntegerField(blank=False, null=False)
+    username = models.CharField(max_length=128, blank=False, null=False)
+    create_time = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return '{0}: {1} of job {2}'.format(self.operation_id, self.operation, self.job_id)
+
+    class Meta:
+        db_table = 'avesjob_operation'
 
 
 class WorkerStatus:
@@ -358,51 +833,77 @@ class AvesWorker(models.Model):
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
 
-    def _kube_start(self):
+    @property
+    def pod_template_key(self):
+        """ Workers with the same key differ only in the fields patched by
+        clone_pod_manifest, so they can share a pod template
+        """
+        return (self.avesrole, self.cpu_request, self.cpu_limit, self.mem_request, self.mem_limit,
+                self.gpu_request, self.entrypoint, json.dumps(self.args, sort_keys=True))
+
+    def make_pod_manifest(self):
+        """ Build the pod of this worker from scratch
+        """
+        m = BaseMaker(self.avesjob, self)
+        return make_pod(
+                   name=self.worker_name,
+                   cmd=m.gen_command(),
+                   args=m.gen_args(),
+                   image=m.gen_image(),
+                   env=m.gen_envs(),
+                   labels=m.gen_pod_labels(),
+                   port_list=[],
+                   volumes=m.gen_volumes(),
+                   volume_mounts=m.gen_volume_mounts(),
+                   cpu_limit=self.cpu_request,
+                   cpu_guarantee=self.cpu_limit,
+                   mem_limit='{mem}Gi'.format(mem=self.mem_request),
+                   mem_guarantee='{mem}Gi'.format(mem=self.mem_limit),
+                   gpu_limit=self.gpu_request,
+                   gpu_guarantee=self.gpu_request,
+               )
+
+    def clone_pod_manifest(self, template):
+        """ Pod of this worker cloned from the pod template of its spec
+
+        Only the worker specific labels and envs of BaseMaker are patched.
+        """
+        labels = dict(template.metadata.labels,
+                      workerId='%s' % self.id,
+                      workerName='%s' % self.worker_name,
+                      username='%s' % self.username)
+        env = {
+            'AVES_MAIN_NODE': 'yes' if self.is_main_node else 'no',
+            'AVES_WORK_POD_ID': str(self.id),
+            'AVES_WORK_INDEX': str(self.role_index),
+            'AVES_API_WORKER_STATUS_REPORT_URL': worker_status_report_url(self.id),
+        }
+        return clone_pod(template, self.worker_name, labels=labels, env=env)
+
+    def _kube_start(self, pod_template=None):
         """ Start aves worker pod
 
+        :param pod_template: pod template of the worker spec, see
+                             AvesJob.build_pod_templates
         :return: result, err_msg
         """
         try:
-            m = BaseMaker(self.avesjob, self)
-
-            configmap = make_configmap(*m.gen_confdata_aves_scripts())
-            k8s_client.delete_namespaced_configmap(configmap.metadata.name, self.namespace)
-            conf, err = k8s_client.create_namespaced_configmap(configmap, self.namespace)
-
-            pod = make_pod(
-                      name=self.worker_name,
-                      cmd=m.gen_command(),
-                      args=m.gen_args(),
-                      image=m.gen_image(),
-                      env=m.gen_envs(),
-                      labels=m.gen_pod_labels(),
-                      port_list=[],
-                      volumes=m.gen_volumes(),
-                      volume_mounts=m.gen_volume_mounts(),
-                      cpu_limit=self.cpu_request,
-                      cpu_guarantee=self.cpu_limit,
-                      mem_limit='{mem}Gi'.format(mem=self.mem_request),
-                      mem_guarantee='{mem}Gi'.format(mem=self.mem_limit),
-                      gpu_limit=self.gpu_request,
-                      gpu_guarantee=self.gpu_request,
-                  )
+            if pod_template is None:
+                pod = self.make_pod_manifest()
+            else:
+                pod = self.clone_pod_manifest(pod_template)
             pod_obj, err = k8s_client.create_namespaced_pod(pod, self.namespace)
             rt = pod_obj is not None
         except Exception as e:
             logger.error('{0}: Fail to start. unhandled exception'.format(self), exc_info=True)
             return None, 'Fail to start worker {}'.format(self.worker_name)
         if rt:
-            self.k8s_status = WorkerStatus.STARTING
-            self.save()
+            self.update_status(WorkerStatus.STARTING)
         return rt, err
 
-    def _swarm_start(self):
+    def _swarm_start(self, scripts_configs):
         try:
             m = BaseMaker(self.avesjob, self)
-            config_datas = make_config_datas(*m.gen_confdata_aves_scripts())
-            configs, err = doc_client.create_multiple_configs(config_datas)
-
             svc_args, svc_kwargs = \
                     make_service(
                         name=self.worker_name,
@@ -413,7 +914,7 @@ class AvesWorker(models.Model):
                         networks=[settings.AVES2_TRAIN_NETWORK],
                         labels=m.gen_pod_labels(),
                         port_list=[],
-                        configs=configs,
+                        configs=scripts_configs,
                         volumes=m.gen_volumes(),
                         volume_mounts=m.gen_volume_mounts(),
                         cpu_limit=self.cpu_request,
@@ -428,15 +929,21 @@ class AvesWorker(models.Model):
             logger.error('{0}: Fail to start. unhandled exception'.format(self), exc_info=True)
             return None, 'Fail to start worker {}'.format(self.worker_name)
         if docker_svc:
-            self.k8s_status = WorkerStatus.STARTING
-            self.save()
+            self.update_status(WorkerStatus.STARTING)
         return docker_svc, err
 
-    def start(self):
+    def start(self, scripts_configs=None, pod_template=None):
+        """ Start aves worker
+
+        :param scripts_configs: docker configs of the job scoped aves scripts,
+                                created by AvesJob. Used in swarm mode only.
+        :param pod_template: pod template of the worker spec. Used in k8s
+                             mode only.
+        """
         if settings.ENABLE_K8S:
-            return self._kube_start()
+            return self._kube_start(pod_template)
         else:
-            return self._swarm_start()
+            return self._swarm_start(scripts_configs)
 
     def _kube_stop(self):
         """ Stop aves worker pod
@@ -444,24 +951,12 @@ class AvesWorker(models.Model):
         :return: result, err_msg
         """
         logger.info('delete job pod: {0}'.format(self))
-        m = BaseMaker(self.avesjob, self)
-        configmap = make_configmap(*m.gen_confdata_aves_scripts())
-
-        st1, msg1 = k8s_client.delete_namespaced_pod(self.worker_name, self.namespace)
-        st2, msg2 = k8s_client.delete_namespaced_configmap(configmap.metadata.name, self.namespace)
-        msg = None if not(msg1 or msg2) else '{0}\n{1}'.format(msg1, msg2)
-        return st1 and st2, msg
+        return k8s_client.delete_namespaced_pod(self.worker_name, self.namespace)
 
     def _docker_stop(self):
         # TODO: rm service and config in celery task
         logger.info('delete job service: {0}'.format(self))
-        m = BaseMaker(self.avesjob, self)
-        config_datas = make_config_datas(*m.gen_confdata_aves_scripts())
-        configmap_name, _ = m.gen_confdata_aves_scripts()
-        st2, msg2 = doc_client.delete_service(self.worker_name)
-        st1, msg1 = doc_client.delete_configs(configmap_name)
-        msg = None if not(msg1 or msg2) else '{0}\n{1}'.format(msg1, msg2)
-        return st1 and st2, msg
+        return doc_client.delete_service(self.worker_name)
 
     def stop(self):
         if settings.ENABLE_K8S:
@@ -473,15 +968,23 @@ class AvesWorker(models.Model):
     def _extract_timestamp(log_line):
         """ Extract timestamp from log line and covert to seconds since the Epoch
 
-        :param log_line: eg. "YYYY-MM-DD hh:mm:ss some message"
+        :param log_line: eg. "YYYY-MM-DD hh:mm:ss some message", or with the
+                         RFC3339 timestamp added by k8s/docker, eg.
+                         "YYYY-MM-DDThh:mm:ss.123456789Z some message"
         :return seconds: return None if fail to match.
         """
-        pattern = re.compile(r'(\d{4}-\d{2}-\d{2}\s\d{2}:\d{2}:\d{2})\s*\S*')
-        match = pattern.match(log_line)
+        match = _TIMESTAMP_PATTERN.match(log_line)
         if not match:
             return None
-        datetime_str = match.group(1)
-        seconds = time.mktime(time.strptime(datetime_str, "%Y-%m-%d %H:%M:%S"))
+        datetime_str = '{0} {1}'.format(match.group(1), match.group(2))
+        time_struct = time.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
+        if match.group(4):
+            # RFC3339 timestamps of k8s/docker are in UTC
+            seconds = calendar.timegm(time_struct)
+        else:
+            seconds = time.mktime(time_struct)
+        if match.group(3):
+            seconds += float(match.group(3))
         return seconds
 
     def _kube_get_worker_log(self, since_seconds=None, follow=False, tail_lines=None):
@@ -511,6 +1014,55 @@ class AvesWorker(models.Model):
                             since_seconds=since_seconds,
                             tail_lines=tail_lines)
 
+    def archive_log(self):
+        """ Copy the whole worker log into the log archive
+
+        :return: (True/False, err_msg)
+        """
+        archive = get_log_archive(AvesWorker._extract_timestamp)
+        try:
+            lines, err_msg = self._stream_live_log(timestamps=True)
+            if lines is None:
+                logger.warning('{0}: Fail to archive log. {1}'.format(self, err_msg))
+                return False, err_msg
+            try:
+                index = archive.write(self.namespace, self.worker_name, lines)
+            finally:
+                lines.close()
+        except Exception:
+            logger.error('{0}: Fail to archive log'.format(self), exc_info=True)
+            return False, 'Fail to archive log of {0}'.format(self.worker_name)
+        logger.info('{0}: archived {1} log lines'.format(self, index['lines']))
+        return True, None
+
+    def _stream_live_log(self, **kwargs):
+        if settings.ENABLE_K8S:
+            return k8s_client.stream_pod_log(self.worker_name, self.namespace, **kwargs)
+        else:
+            return doc_client.stream_container_log(self.worker_name, **kwargs)
+
+    def stream_worker_log(self, follow=False, since_seconds=None, tail_lines=None,
+                          limit_bytes=None, timestamps=True):
+        """ Stream worker log
+
+        Logs of finished workers are served from the log archive when they
+        have been archived, since their pods may be deleted already.
+
+        :return: (generator of log lines, err_msg)
+        """
+        kwargs = dict(follow=follow, since_seconds=since_seconds, tail_lines=tail_lines,
+                      limit_bytes=limit_bytes, timestamps=timestamps)
+        archive = get_log_archive(AvesWorker._extract_timestamp)
+        if archive is not None \
+                and self.k8s_status in [WorkerStatus.FINISHED, WorkerStatus.FAILURE, WorkerStatus.CANCELED] \
+                and archive.exists(self.namespace, self.worker_name):
+            return archive.read(self.namespace, self.worker_name, **kwargs)
+        lines, err_msg = self._stream_live_log(**kwargs)
+        if lines is None and archive is not None and archive.exists(self.namespace, self.worker_name):
+            # the pod is gone before the worker status caught up
+            return archive.read(self.namespace, self.worker_name, **kwargs)
+        return lines, err_msg
+
     def _k8s_get_worker_info(self):
         rt, err_msg = k8s_client.get_pod_status(self.worker_name, self.namespace)
         return rt.to_str(), err_msg
@@ -525,31 +1077,66 @@ class AvesWorker(models.Model):
         else:
             return self._docker_get_worker_info()
 
+    @staticmethod
+    def make_log_urls(pod_status):
+        """ Make log urls of the log server on the node of a pod
+
+        :param pod_status: kubernetes.client.models.v1_pod_status.V1PodStatus
+        :return tuple: (readlog_url, loginfo_url) or None if the container
+                       is not created yet
+        """
+        if not pod_status or not pod_status.host_ip or not pod_status.container_statuses \
+                or not pod_status.container_statuses[0].container_id:
+            return None
+        host_ip = pod_status.host_ip
+        container_id = pod_status.container_statuses[0].container_id \
+                        .split('docker://')[-1]
+        port = settings.LOG_SERVER_PORT
+        readlog_prefix = settings.READLOG_URLPREFIX
+        loginfo_prefix = settings.LOGINFO_URLPREFIX
+        readlog_url = f"http://{host_ip}:{port}/{readlog_prefix}?filename={container_id}"
+        loginfo_url = f"http://{host_ip}:{port}/{loginfo_prefix}?filename={container_id}"
+        return (readlog_url, loginfo_url)
+
     def get_container_log_info(self):
         """ generate two url for PAI server to get container log infomation
 
         :return tuple: (readlong_url, loginfo_url) or None
         """
-        if not hasattr(self, '_readlog_url'):
+        if not hasattr(self, '_log_urls'):
             pod_status, err = k8s_client.get_pod_status(self.worker_name, self.namespace)
             if err:
                 return None
-            host_ip = pod_status.host_ip
-            container_id = pod_status.container_statuses[0].container_id \
-                            .split('docker://')[-1]
-            port = settings.LOG_SERVER_PORT
-            readlog_prefix = settings.READLOG_URLPREFIX
-            loginfo_prefix = settings.LOGINFO_URLPREFIX
-            readlog_url = f"http://{host_ip}:{port}/{readlog_prefix}?filename={container_id}"
-            loginfo_url = f"http://{host_ip}:{port}/{loginfo_prefix}?filename={container_id}"
-            setattr(self, '_readlog_url', readlog_url)
-            setattr(self, '_loginfo_url', loginfo_url)
-        return (self._readlog_url, self._loginfo_url)
+            setattr(self, '_log_urls', self.make_log_urls(pod_status))
+        return self._log_urls
 
     def update_status(self, status, msg=''):
+        """ Change worker status and the worker counters of its job
+
+        The job row is locked while the counters are changed, so concurrent
+        status changes of workers in the same job are serialized and exactly
+        one of them sees the last active worker leave.
+
+        :return: worker_status_count of the job after the change, empty
+                 for jobs created before the counters were added
+        """
         # TODO: replace k8s status with status
+        now = timezone.now()
+        with transaction.atomic():
+            job = AvesJob.objects.select_for_update() \
+                        .only('id', 'worker_status_count').get(id=self.avesjob_id)
+            # re-read the old status under the job lock
+            old_status = AvesWorker.objects.filter(id=self.id) \
+                            .values_list('k8s_status', flat=True).first()
+            AvesWorker.objects.filter(id=self.id).update(k8s_status=status, update_time=now)
+            counts = job.worker_status_count
+            if counts and old_status != status:
+                counts[old_status] = max(counts.get(old_status, 0) - 1, 0)
+                counts[status] = counts.get(status, 0) + 1
+                AvesJob.objects.filter(id=job.id).update(worker_status_count=counts)
         self.k8s_status = status
-        self.save()
+        self.update_time = now
+        return counts
 
     def __str__(self):
         return self.worker_name
@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+
+
+class AvesJobCursorPagination(CursorPagination):
+    """ Keyset pagination of jobs on -id
+
+    Only applied when the request asks for it with `cursor` or `page_size`,
+    so clients listing all jobs keep getting a plain list.
+    """
+    ordering = '-id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params \
+                and self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
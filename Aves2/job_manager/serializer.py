@@ -7,6 +7,14 @@ from .models import AvesJob, AvesWorker
 class AvesJobSerializer(serializers.ModelSerializer):
     job_name = serializers.SerializerMethodField()
 
+    def __init__(self, *args, **kwargs):
+        # sparse fieldset: only serialize the given fields
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     class Meta:
         model = AvesJob
         fields = '__all__'
@@ -35,15 +43,22 @@ class WorkerLogSerializer(serializers.ModelSerializer):
     def get_pod_name(self, obj):
         return obj.worker_name
 
+    def _get_url_info(self, obj):
+        # log urls of all workers resolved once by the view, see AvesJob.get_worker_log_urls
+        log_urls = self.context.get('log_urls')
+        if log_urls is not None:
+            return log_urls.get(obj.id)
+        return obj.get_container_log_info()
+
     def get_readlog_url(self, obj):
-        url_info = obj.get_container_log_info()
+        url_info = self._get_url_info(obj)
         if not url_info:
             return ''
         else:
             return url_info[0]
 
     def get_loginfo_url(self, obj):
-        url_info = obj.get_container_log_info()
+        url_info = self._get_url_info(obj)
         if not url_info:
             return ''
         else:
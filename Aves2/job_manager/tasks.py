@@ -4,7 +4,6 @@ import os
 import time
 import datetime
 import json
-import pika
 import pickle
 import logging
 import traceback
@@ -19,8 +18,7 @@ from celery import task, shared_task, chain, group
 from celery_once import QueueOnce
 
 from job_manager.models import JobStatus, WorkerStatus, AvesJob, AvesWorker
-from kubernetes_client import K8SPodPhase
-from common_utils.rabbitmq import get_connection
+from kubernetes_client import K8SPodPhase, pod_event_summary
 
 
 logger = logging.getLogger('aves2')
@@ -38,95 +36,142 @@ def add(x, y):
     return x+y
 
 
-@shared_task(name='start_avesjob', bind=True)
+# lifecycle tasks of a job are deduplicated on job_id by celery_once, and
+# report their step with update_state so that views can return at once
+LIFECYCLE_ONCE = {'graceful': True, 'keys': ['job_id']}
+
+
+class LifecycleTask(QueueOnce):
+    """ QueueOnce which falls back to a plain Task when no lock server is set
+    """
+    abstract = True
+
+    @property
+    def locking(self):
+        return bool(self.config.get('ONCE'))
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        if not self.locking:
+            options.pop('once', None)
+            return celery.Task.apply_async(self, args, kwargs, **options)
+        return super(LifecycleTask, self).apply_async(args, kwargs, **options)
+
+    def after_return(self, *args, **kwargs):
+        if self.locking:
+            super(LifecycleTask, self).after_return(*args, **kwargs)
+
+
+def _progress(task, job_id, step):
+    logger.info(f'job {job_id}: {step}')
+    if task.request.id:
+        task.update_state(state='PROGRESS', meta={'job_id': job_id, 'step': step})
+
+
+@shared_task(name='start_avesjob', bind=True, base=LifecycleTask, once=LIFECYCLE_ONCE)
 def start_avesjob(self, job_id):
     avesjob = AvesJob.objects.get(id=job_id)
     if not avesjob.ready_to_run:
-        return
+        return {'success': False, 'errorMessage': f'job is {avesjob.status}'}
 
-    avesjob.update_status('STARTING', msg='')
+    if not avesjob.update_status('STARTING', msg=''):
+        return {'success': False, 'errorMessage': 'job status has been changed by others'}
+    _progress(self, job_id, 'starting workers')
     rt, err_msg = avesjob.start()
     if not rt:
-        avesjob.update_status('FAILURE', msg=err_msg)
+        # keep the status if the job has been canceled in the meantime
+        avesjob.transition_status(JobStatus.FAILURE, msg=err_msg,
+                                  from_statuses=[JobStatus.STARTING, JobStatus.PENDING, JobStatus.RUNNING])
+    return {'success': bool(rt), 'errorMessage': err_msg or ''}
+
+
+@shared_task(name='start_avesjobs', bind=True)
+def start_avesjobs(self, job_ids):
+    """ Fan out start_avesjob of jobs submitted in bulk
+    """
+    group(start_avesjob.s(job_id) for job_id in job_ids).apply_async()
 
 
-@shared_task(name='cancel_avesjob', bind=True)
+@shared_task(name='cancel_avesjob', bind=True, base=LifecycleTask, once=LIFECYCLE_ONCE)
 def cancel_avesjob(self, job_id, force=False):
     """ 取消Aves训练任务
     """
-    avesjob = AvesJob.objects.filter(id=job_id)
-    namespace = avesjob.namespace
-    msg = ''
-
+    avesjob = AvesJob.objects.get(id=job_id)
+    _progress(self, job_id, 'stopping workers')
     rt, err_msg = avesjob.cancel()
-    avesjob.update_status('CANCELED')
+    # pod events of the stopped workers change the status during cancel()
+    if not avesjob.transition_status(JobStatus.CANCELED):
+        rt, err_msg = False, '; '.join(filter(None, [err_msg, 'fail to change job status']))
+    return {'success': bool(rt), 'errorMessage': err_msg or ''}
+
+
+@shared_task(name='clean_avesjob', bind=True, base=LifecycleTask, once=LIFECYCLE_ONCE)
+def clean_avesjob(self, job_id, force=False):
+    """ Delete workers of a job, the debug main node is kept unless force
+    """
+    avesjob = AvesJob.objects.get(id=job_id)
+    _progress(self, job_id, 'cleaning workers')
+    avesjob.clean_work(force=force)
+    return {'success': True, 'errorMessage': ''}
+
+
+@shared_task(name='destroy_avesjob', bind=True, base=LifecycleTask, once=LIFECYCLE_ONCE)
+def destroy_avesjob(self, job_id):
+    """ Delete workers of a job, then the job itself
+    """
+    try:
+        avesjob = AvesJob.objects.get(id=job_id)
+    except AvesJob.DoesNotExist:
+        return {'success': True, 'errorMessage': ''}
+    _progress(self, job_id, 'cleaning workers')
+    avesjob.clean_work(force=True)
+    _progress(self, job_id, 'deleting job')
+    avesjob.delete()
+    return {'success': True, 'errorMessage': ''}
 
 
 @shared_task(name='process_k8s_pod_event', bind=True)
 def process_k8s_pod_event(self, event):
-    event_type = event.get('type')
-    pod = event['object']
-    pod_name = pod.metadata.name
-    phase = pod.status.phase
-    worker_id = pod.metadata.labels.get('workerId')
+    """
+    :param event: dict made by kubernetes_client.pod_event_summary
+    """
+    if 'object' in event:
+        # pickled watch event sent by an old watcher
+        event = pod_event_summary(event.get('type'), event['object'])
+    event_type = event['type']
+    pod_name = event['pod_name']
+    phase = event['phase']
+    worker_id = event['worker_id']
     logger.info(f"receive pod event type:{event_type} pod_name:{pod_name} phase:{phase}")
 
-    worker = AvesWorker.objects.get(id=worker_id)
+    worker = AvesWorker.objects.filter(id=worker_id).first()
+    if worker is None:
+        # the job has been deleted together with its pods
+        logger.info(f'worker of pod {pod_name} not found')
+        return
     if phase == K8SPodPhase.SUCCEEDED \
             and worker.k8s_status in [WorkerStatus.STARTING, WorkerStatus.RUNNING]:
-        worker.update_status(WorkerStatus.FINISHED)
+        counts = worker.update_status(WorkerStatus.FINISHED)
         job = worker.avesjob
-        if job.status in [JobStatus.STARTING, JobStatus.RUNNING] and \
-            job.aves_worker.filter(k8s_status__in=[
-                                    WorkerStatus.STARTING,
-                                    WorkerStatus.RUNNING]).count() == 0:
-            job.update_status(JobStatus.FINISHED, msg='Job finished')
+        if job.active_worker_count(counts) == 0:
+            job.transition_status(JobStatus.FINISHED, msg='Job finished',
+                                  from_statuses=[JobStatus.STARTING, JobStatus.RUNNING])
     elif phase == K8SPodPhase.FAILED \
             and worker.k8s_status in [WorkerStatus.STARTING, WorkerStatus.RUNNING]:
-        worker.update_status(WorkerStatus.FAILURE)
+        counts = worker.update_status(WorkerStatus.FAILURE)
         job = worker.avesjob
-        if job.status in [JobStatus.STARTING, JobStatus.RUNNING] and \
-            job.aves_worker.filter(k8s_status__in=[
-                                    WorkerStatus.STARTING,
-                                    WorkerStatus.RUNNING]).count() == 0:
+        if job.active_worker_count(counts) == 0:
             msg = f'{job.msg}; {pod_name} failed'.strip('; ')
-            job.update_status(JobStatus.FAILURE, msg=msg)
+            job.transition_status(JobStatus.FAILURE, msg=msg,
+                                  from_statuses=[JobStatus.STARTING, JobStatus.RUNNING])
     elif phase == K8SPodPhase.PENDING:
-        container_statuses = pod.status.container_statuses
-        if container_statuses and container_statuses[0].state.waiting:
-            waiting_reason = container_statuses[0].state.waiting.reason
-            waiting_msg = container_statuses[0].state.waiting.message
+        waiting_reason = event['waiting_reason']
+        waiting_msg = event['waiting_msg']
+        if waiting_reason:
             if waiting_reason in ['ImagePullBackOff', 'ErrImagePull', 'CreateContainerError'] \
                     and worker.k8s_status in [WorkerStatus.STARTING, WorkerStatus.RUNNING]:
                 worker.update_status(WorkerStatus.FAILURE, msg=waiting_reason)
                 job = worker.avesjob
                 msg = f'{job.msg}; {pod_name} {waiting_reason} {waiting_msg}'.strip('; ')
-                job.update_status(JobStatus.FAILURE, msg=msg)
-                job.clean_work(force=True)
-
-
-@shared_task(name='report-avesjob-status', bind=True)
-def report_avesjob_status(self, job_id, status, msg):
-    report_data = {
-        'jobId': job_id,
-        'status': status,
-        'msg': msg}
-    body = json.dumps(report_data)
-
-    connection = None
-    try:
-        connection = get_connection(settings.RABBITMQ_HOST, settings.RABBITMQ_USER, settings.RABBITMQ_PASS)
-        channel = connection.channel()
-        channel.exchange_declare(exchange=settings.STATUS_REPORT_EXCHANGE,
-                                 exchange_type=settings.STATUS_REPORT_EXCHANGE_TYPE,
-                                 durable=True)
-        channel.basic_publish(exchange=settings.STATUS_REPORT_EXCHANGE,
-                              routing_key=settings.STATUS_REPORT_ROUTING_KEY,
-                              body=body,
-                              properties=pika.BasicProperties(delivery_mode=2))
-        logger.info(f'Send job status report {body}')
-    except Exception as e:
-        logger.error(f'Fail to send job status report: {body}', exc_info=True)
-    finally:
-        if connection:
-            connection.close()
+                if job.transition_status(JobStatus.FAILURE, msg=msg,
+                                         from_statuses=[JobStatus.STARTING, JobStatus.RUNNING]):
+                    job.clean_work(force=True)
@@ -19,7 +19,7 @@ from django.conf.urls import url
 from rest_framework.routers import DefaultRouter
 
 from job_manager.views import AvesJobViewSet, AvesWorkerViewSet
-from job_manager.views import client_check
+from job_manager.views import client_check, k8s_connection_stats
 
 
 router = DefaultRouter()
@@ -27,7 +27,8 @@ router.register(r'aves_job', AvesJobViewSet, base_name="aves_job")
 router.register(r'aves_worker', AvesWorkerViewSet, base_name="aves_worker")
 
 urlpatterns = [
-    path('client_check', client_check, name='client_check')
+    path('client_check', client_check, name='client_check'),
+    path('k8s_connection_stats', k8s_connection_stats, name='k8s_connection_stats'),
 ]
 
 urlpatterns += router.urls
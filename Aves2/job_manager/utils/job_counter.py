@@ -0,0 +1,50 @@
+import logging
+
+from django.conf import settings
+from django.db.models import Count
+
+from common_utils.shared_cache import cache
+
+logger = logging.getLogger('aves2')
+
+ALL_USERS = '*'
+
+
+def _count_key(username, status):
+    return 'aves2:job_count:{0}:{1}'.format(username, status)
+
+
+def incr_job_count(username, status, delta=1):
+    """ Change the cached job counters of a user and of all users
+
+    Counters which are not cached are left alone, they are counted from the
+    db on the next read.
+    """
+    for user in (username, ALL_USERS):
+        try:
+            cache.incr(_count_key(user, status), delta)
+        except ValueError:
+            pass
+
+
+def get_job_counts(queryset, username, statuses):
+    """ Number of jobs in each status
+
+    Counters are read from the cache, on a miss they are counted with one
+    GROUP BY query on queryset. The cache expires after
+    AVES_JOB_COUNT_CACHE_TTL seconds to bound drift of the counters.
+
+    :param queryset: AvesJob queryset of the user
+    :param username: username, or ALL_USERS
+    :return: {status: count}
+    """
+    keys = {status: _count_key(username, status) for status in statuses}
+    cached = cache.get_many(list(keys.values()))
+    if len(cached) == len(keys):
+        return {status: cached[key] for status, key in keys.items()}
+
+    counts = dict.fromkeys(statuses, 0)
+    counts.update(queryset.order_by().values_list('status').annotate(Count('id')))
+    cache.set_many({keys[status]: counts[status] for status in statuses},
+                   getattr(settings, 'AVES_JOB_COUNT_CACHE_TTL', 600))
+    return counts
@@ -0,0 +1,154 @@
+import os
+import gzip
+import json
+import time
+import shutil
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger('aves2')
+
+
+class LogArchive(object):
+    """ Worker logs archived on a local filesystem
+
+    The log of a worker is stored as gzip segments of segment_lines lines
+    under <root>/<namespace>/<worker_name>/, with an index.json that keeps
+    the line offset and the first/last timestamp of every segment. Reads
+    with since_seconds/tail_lines open only the segments they need.
+    """
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, root, extract_timestamp, segment_lines=10000):
+        self.root = root
+        self.extract_timestamp = extract_timestamp
+        self.segment_lines = segment_lines
+
+    def _worker_dir(self, namespace, worker_name):
+        return os.path.join(self.root, namespace, worker_name)
+
+    def load_index(self, namespace, worker_name):
+        path = os.path.join(self._worker_dir(namespace, worker_name), self.INDEX_FILE)
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def exists(self, namespace, worker_name):
+        return self.load_index(namespace, worker_name) is not None
+
+    def write(self, namespace, worker_name, lines):
+        """ Archive log lines, replacing an older archive of the worker
+
+        Segments are written to a temp dir which is renamed once complete,
+        so readers never see a partial archive.
+
+        :return: index dict
+        """
+        worker_dir = self._worker_dir(namespace, worker_name)
+        tmp_dir = '{0}.tmp{1}'.format(worker_dir, os.getpid())
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        segments = []
+        seg = f = None
+        total = 0
+        last_ts = None
+        try:
+            for line in lines:
+                if f is None:
+                    seg = {'file': '{0:05d}.log.gz'.format(len(segments)),
+                           'first_line': total, 'lines': 0, 'first_ts': None, 'last_ts': None}
+                    f = gzip.open(os.path.join(tmp_dir, seg['file']), 'wt', encoding='utf-8')
+                ts = self.extract_timestamp(line)
+                if ts is not None:
+                    last_ts = ts
+                if seg['first_ts'] is None:
+                    seg['first_ts'] = last_ts
+                seg['last_ts'] = last_ts
+                f.write(line + '\n')
+                seg['lines'] += 1
+                total += 1
+                if seg['lines'] >= self.segment_lines:
+                    f.close()
+                    segments.append(seg)
+                    f = None
+            if f is not None:
+                f.close()
+                segments.append(seg)
+                f = None
+
+            index = {'worker_name': worker_name, 'lines': total,
+                     'archive_time': time.time(), 'segments': segments}
+            with open(os.path.join(tmp_dir, self.INDEX_FILE), 'w') as index_f:
+                json.dump(index, index_f)
+            shutil.rmtree(worker_dir, ignore_errors=True)
+            os.rename(tmp_dir, worker_dir)
+        except Exception:
+            if f is not None:
+                f.close()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return index
+
+    def read(self, namespace, worker_name, since_seconds=None, tail_lines=None,
+             limit_bytes=None, timestamps=True, **kwargs):
+        """ Read archived log lines, same params as AvesWorker.stream_worker_log
+
+        :return: (generator of log lines, err_msg)
+        """
+        index = self.load_index(namespace, worker_name)
+        if index is None:
+            return None, 'Log archive not found'
+        cutoff = time.time() - since_seconds if since_seconds is not None else None
+        start_line = max(index['lines'] - tail_lines, 0) if tail_lines is not None else 0
+        segments = [s for s in index['segments']
+                    if s['first_line'] + s['lines'] > start_line
+                    and (cutoff is None or s['last_ts'] is None or s['last_ts'] >= cutoff)]
+        worker_dir = self._worker_dir(namespace, worker_name)
+        return self._read_segments(worker_dir, segments, start_line, cutoff,
+                                   limit_bytes, timestamps), None
+
+    def _read_segments(self, worker_dir, segments, start_line, cutoff, limit_bytes, timestamps):
+        read_bytes = 0
+        for seg in segments:
+            last_ts = seg['first_ts']
+            with gzip.open(os.path.join(worker_dir, seg['file']), 'rt', encoding='utf-8') as f:
+                for offset, line in enumerate(f, seg['first_line']):
+                    line = line.rstrip('\n')
+                    ts = self.extract_timestamp(line)
+                    if ts is not None:
+                        last_ts = ts
+                    if offset < start_line:
+                        continue
+                    if cutoff is not None and last_ts is not None and last_ts < cutoff:
+                        continue
+                    if not timestamps and ts is not None:
+                        line = line.split(' ', 1)[-1]
+                    read_bytes += len(line) + 1
+                    if limit_bytes is not None and read_bytes > limit_bytes:
+                        return
+                    yield line
+
+    def delete(self, namespace, worker_name):
+        shutil.rmtree(self._worker_dir(namespace, worker_name), ignore_errors=True)
+
+
+_log_archive = None
+
+
+def get_log_archive(extract_timestamp):
+    """ Process wide LogArchive, None if AVES_LOG_ARCHIVE_DIR is not set
+    """
+    global _log_archive
+    root = getattr(settings, 'AVES_LOG_ARCHIVE_DIR', os.environ.get('AVES_LOG_ARCHIVE_DIR'))
+    if not root:
+        return None
+    if _log_archive is None:
+        _log_archive = LogArchive(
+                            root,
+                            extract_timestamp,
+                            segment_lines=getattr(settings, 'AVES_LOG_ARCHIVE_SEGMENT_LINES', 10000))
+    return _log_archive
@@ -0,0 +1,143 @@
+import os
+import time
+import heapq
+import queue
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger('aves2')
+
+# default of AVES_LOG_MUX_MAX_WORKERS: every merged worker costs a reader
+# thread and an open log stream (a k8s api connection or a docker socket)
+# for as long as the client reads
+DEFAULT_MAX_WORKERS = 64
+
+_EOF = object()
+
+
+def get_max_workers():
+    """ Most workers one merged log stream may read
+    """
+    return int(getattr(settings, 'AVES_LOG_MUX_MAX_WORKERS',
+                       os.environ.get('AVES_LOG_MUX_MAX_WORKERS', DEFAULT_MAX_WORKERS)))
+
+
+def _strip_timestamp(line):
+    parts = line.split(' ', 1)
+    return parts[1] if len(parts) > 1 else ''
+
+
+def _put(out_queue, item, stop):
+    """ Put item to the queue unless the merger has stopped
+
+    Blocks while the merger is behind, which throttles the upstream read.
+    """
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read_worker_log(index, worker, log_params, out_queue, stop, streams):
+    """ Read log lines of one worker into the shared queue
+
+    The opened stream is kept in streams[index] so that the merger can
+    abort it when the client goes away.
+    """
+    lines = None
+    try:
+        lines, err_msg = worker.stream_worker_log(**log_params)
+        if lines is None:
+            _put(out_queue, (index, 'Fail to read log: {0}'.format(err_msg)), stop)
+            return
+        streams[index] = lines
+        if stop.is_set():
+            return
+        for line in lines:
+            if not _put(out_queue, (index, line), stop):
+                return
+    except Exception:
+        if not stop.is_set():
+            logger.error('{0}: log stream broken'.format(worker), exc_info=True)
+    finally:
+        if lines is not None:
+            lines.close()
+        _put(out_queue, (index, _EOF), stop)
+
+
+def merge_worker_logs(workers, log_params, extract_timestamp,
+                      merge_delay=1.0, buffer_lines=1000):
+    """ Stream logs of all workers merged by timestamp
+
+    One reader thread per worker pushes lines to a bounded queue. Lines are
+    held in a heap and the oldest one is emitted once every live stream has
+    a line buffered, or once it has waited merge_delay seconds, so an idle
+    worker does not stall a followed stream. At most buffer_lines lines are
+    held in memory. Each line is prefixed by "[<role>-<index>]".
+
+    :param workers: AvesWorker list, at most get_max_workers() long
+    :param log_params: kwargs of AvesWorker.stream_worker_log
+    :param extract_timestamp: fn(line) -> seconds or None
+    :return: generator of log lines
+    """
+    show_timestamps = log_params.get('timestamps', True)
+    log_params = dict(log_params, timestamps=True)
+    out_queue = queue.Queue(maxsize=buffer_lines)
+    stop = threading.Event()
+    streams = [None] * len(workers)
+    prefixes = ['[{0}-{1}]'.format(w.avesrole, w.role_index) for w in workers]
+
+    for index, worker in enumerate(workers):
+        thread = threading.Thread(
+                    target=_read_worker_log,
+                    args=(index, worker, log_params, out_queue, stop, streams),
+                    name='aves-log-{0}'.format(worker.id))
+        thread.daemon = True
+        thread.start()
+
+    heap = []  # (timestamp, seq, index, line, arrival)
+    buffered = [0] * len(workers)
+    last_ts = [0.0] * len(workers)
+    live = set(range(len(workers)))
+    seq = 0
+    try:
+        while live or heap:
+            while heap and (not live
+                            or all(buffered[i] for i in live)
+                            or time.time() - heap[0][4] >= merge_delay
+                            or len(heap) >= buffer_lines):
+                _, _, index, line, _ = heapq.heappop(heap)
+                buffered[index] -= 1
+                yield '{0} {1}'.format(prefixes[index], line)
+            if not live:
+                break
+            try:
+                index, line = out_queue.get(timeout=merge_delay)
+            except queue.Empty:
+                continue
+            if line is _EOF:
+                live.discard(index)
+                continue
+            ts = extract_timestamp(line)
+            if ts is None:
+                # keep continuation lines after the line they belong to
+                ts = last_ts[index]
+            elif not show_timestamps:
+                line = _strip_timestamp(line)
+            last_ts[index] = ts
+            seq += 1
+            buffered[index] += 1
+            heapq.heappush(heap, (ts, seq, index, line, time.time()))
+    finally:
+        stop.set()
+        # wake up readers blocked on quiet followed logs, so that their
+        # threads and connections are released now
+        for lines in streams:
+            abort = getattr(lines, 'abort', None)
+            if abort is not None:
+                abort()
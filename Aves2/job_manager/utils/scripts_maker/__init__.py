@@ -3,6 +3,8 @@
 import os
 import json
 import argparse
+import threading
+from collections import defaultdict
 
 from django.conf import settings
 from jinja2 import PackageLoader, Environment, FileSystemLoader
@@ -10,11 +12,61 @@ from jinja2 import PackageLoader, Environment, FileSystemLoader
 TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
 
 
-def gen_aves_run_script(code_spec, input_specs, output_specs, log_spec):
-    tpl_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
-    env = Environment(loader=FileSystemLoader(tpl_path))
-    tpl = env.get_template(os.path.join('aves_run.sh.tmpl'))
+class TemplateRegistry(object):
+    """ Load and compile script templates once per process
+
+    Jinja templates are compiled on first use and kept in the environment
+    cache, plain scripts are read from disk once. With auto_reload, files
+    are checked by mtime and reloaded when changed (for development).
+    """
+    def __init__(self, tpl_path, auto_reload=False):
+        self.tpl_path = tpl_path
+        self.auto_reload = auto_reload
+        self.env = Environment(loader=FileSystemLoader(tpl_path), auto_reload=auto_reload)
+        self._files = {}  # filename -> (mtime, content)
+        self._lock = threading.Lock()
+        self._render_counts = defaultdict(int)
+
+    def render(self, tpl_name, context):
+        tpl = self.env.get_template(tpl_name)
+        with self._lock:
+            self._render_counts[tpl_name] += 1
+        return tpl.render(context)
+
+    def read(self, filename):
+        path = os.path.join(self.tpl_path, filename)
+        cached = self._files.get(filename)
+        if cached and not self.auto_reload:
+            content = cached[1]
+        else:
+            mtime = os.path.getmtime(path)
+            if cached and cached[0] == mtime:
+                content = cached[1]
+            else:
+                with open(path) as f:
+                    content = f.read()
+                self._files[filename] = (mtime, content)
+        with self._lock:
+            self._render_counts[filename] += 1
+        return content
+
+    def render_counts(self):
+        with self._lock:
+            return dict(self._render_counts)
+
 
+_registry = None
+
+
+def get_template_registry():
+    global _registry
+    if _registry is None:
+        auto_reload = getattr(settings, 'AVES_TEMPLATE_AUTO_RELOAD', settings.DEBUG)
+        _registry = TemplateRegistry(TEMPLATE_PATH, auto_reload=auto_reload)
+    return _registry
+
+
+def gen_aves_run_script(code_spec, input_specs, output_specs, log_spec):
     context = {
         'code_spec': code_spec,
         'log_spec': log_spec,
@@ -22,28 +74,20 @@ def gen_aves_run_script(code_spec, input_specs, output_specs, log_spec):
         'output_specs': output_specs,
         'run_as_root': settings.AVES_RUN_AS_ROOT
     }
-    return tpl.render(context)
+    return get_template_registry().render('aves_run.sh.tmpl', context)
 
 
 def gen_config_aws_script():
-    tpl_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
-    with open(os.path.join(tpl_path, 'aves_config_aws.sh')) as f:
-        return f.read()
+    return get_template_registry().read('aves_config_aws.sh')
 
 
 def gen_aves_dist_envs_script():
-    tpl_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
-    with open(os.path.join(tpl_path, 'aves_get_dist_envs.py')) as f:
-        return f.read()
+    return get_template_registry().read('aves_get_dist_envs.py')
 
 
 def gen_aves_report_script():
-    tpl_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
-    with open(os.path.join(tpl_path, 'aves_report.py')) as f:
-        return f.read()
+    return get_template_registry().read('aves_report.py')
 
 
 def gen_aves_run_wrapper():
-    tpl_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
-    with open(os.path.join(tpl_path, 'aves_run_wrapper.sh')) as f:
-        return f.read()
+    return get_template_registry().read('aves_run_wrapper.sh')
@@ -9,26 +9,43 @@ import time
 AVES_API_HOST = os.environ['AVES_API_HOST']
 AVES_API_TOKEN = os.environ['AVES_API_TOKEN']
 AVES_API_JOB_DIST_ENVS_URL = os.environ['AVES_API_JOB_DIST_ENVS_URL']
+# aves server holds the request until all workers are ready (long-poll)
+AVES_DIST_ENVS_WAIT = int(os.environ.get('AVES_DIST_ENVS_WAIT', 30))
+RETRY_INTERVAL = 10
+# workers may wait long to be scheduled, but not forever
+AVES_DIST_ENVS_RETRIES = int(os.environ.get('AVES_DIST_ENVS_RETRIES', 360))
 
 HEADERS = {
     'Authorization': 'Token %s' % AVES_API_TOKEN,
 }
 
 
+class RetryableError(Exception):
+    pass
+
+
 def get_dist_envs(dst_env_file):
+    """
+    :return: True on success, False on errors not worth a retry
+    :raise RetryableError: on connection errors, timeouts and 5xx
+    """
     url = os.path.join(AVES_API_HOST, AVES_API_JOB_DIST_ENVS_URL)
+    params = {'wait': AVES_DIST_ENVS_WAIT}
 
     try:
-        r = requests.get(url, headers=HEADERS)
-    except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError) as e:
-        print(e)
-        return False
+        r = requests.get(url, headers=HEADERS, params=params, timeout=AVES_DIST_ENVS_WAIT + 30)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        raise RetryableError(e)
 
     if not r.ok:
         try:
-            print("Warning: {0}".format(r.json()['detail']))
-        except Exception as e:
-            print(e)
+            detail = r.json()['detail']
+        except Exception:
+            detail = r.text
+        # workers not ready yet are reported as a server error
+        if r.status_code >= 500:
+            raise RetryableError(detail)
+        print("Error: {0} {1}".format(r.status_code, detail))
         return False
 
     with open(dst_env_file, 'w') as f:
@@ -39,5 +56,19 @@ def get_dist_envs(dst_env_file):
 
 if __name__ == '__main__':
     env_file = sys.argv[1]
-    if not get_dist_envs(env_file):
-        exit(2)
+    for _ in range(AVES_DIST_ENVS_RETRIES):
+        start = time.time()
+        try:
+            if get_dist_envs(env_file):
+                sys.exit(0)
+            sys.exit(1)
+        except RetryableError as e:
+            print("Warning: {0}".format(e))
+        print("try again later ...")
+        sys.stdout.flush()
+        # only sleep if server returned before the long-poll timeout
+        elapsed = time.time() - start
+        if elapsed < RETRY_INTERVAL:
+            time.sleep(RETRY_INTERVAL - elapsed)
+    print("Error: fail to get cluster info after {0} tries".format(AVES_DIST_ENVS_RETRIES))
+    sys.exit(1)
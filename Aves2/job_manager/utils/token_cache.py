@@ -0,0 +1,129 @@
+import time
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from common_utils.shared_cache import cache
+
+logger = logging.getLogger('aves2')
+
+
+class _LocalCache(object):
+    """ Process local dict with a TTL per entry
+    """
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[1] < time.time():
+                self._data.pop(key, None)
+                return None
+            return item[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+_local = _LocalCache()
+
+
+def _local_ttl():
+    return getattr(settings, 'AVES_TOKEN_LOCAL_CACHE_TTL', 30)
+
+
+def _shared_ttl():
+    return getattr(settings, 'AVES_TOKEN_CACHE_TTL', 300)
+
+
+def _user_key(username):
+    return 'aves2:token:user:{0}'.format(username)
+
+
+def _token_key(key):
+    return 'aves2:token:key:{0}'.format(key)
+
+
+def get_user_token(username):
+    """ Api token key of a user, created if the user has none
+
+    Looked up in a process local cache, then in the shared cache, then in
+    the db with one query.
+    """
+    cache_key = _user_key(username)
+    token = _local.get(cache_key)
+    if token is None:
+        token = cache.get(cache_key)
+        if token is None:
+            try:
+                token = Token.objects.only('key').get(user__username=username).key
+            except Token.DoesNotExist:
+                token = Token.objects.create(user=User.objects.get(username=username)).key
+            cache.set(cache_key, token, _shared_ttl())
+        _local.set(cache_key, token, _local_ttl())
+    return token
+
+
+def get_token_user(key):
+    """ (user, token) of a token key, None if the key is invalid
+    """
+    cache_key = _token_key(key)
+    item = _local.get(cache_key)
+    if item is None:
+        item = cache.get(cache_key)
+        if item is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                return None
+            item = (token.user, token)
+            cache.set(cache_key, item, _shared_ttl())
+        _local.set(cache_key, item, _local_ttl())
+    return item
+
+
+def invalidate_token(token):
+    """ Drop a token from the caches
+
+    Other processes keep their local copy for at most
+    AVES_TOKEN_LOCAL_CACHE_TTL seconds.
+    """
+    username = token.user.username
+    for cache_key in (_user_key(username), _token_key(token.key)):
+        _local.delete(cache_key)
+        cache.delete(cache_key)
+
+
+@receiver(post_save, sender=Token)
+def _invalidate_saved_token(sender, instance, **kwargs):
+    invalidate_token(instance)
+
+
+@receiver(post_delete, sender=Token)
+def _invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance)
+
+
+@receiver(post_save, sender=User)
+def _invalidate_user_tokens(sender, instance, created, **kwargs):
+    # cached (user, token) pairs carry is_active/is_superuser of the user,
+    # a login only updates last_login
+    update_fields = kwargs.get('update_fields')
+    if created or (update_fields and set(update_fields) == {'last_login'}):
+        return
+    for token in Token.objects.filter(user=instance).select_related('user'):
+        invalidate_token(token)
@@ -12,6 +12,16 @@ from job_manager.utils.work_builder.data_spec import make_data_spec, DataSpecKin
 # /export/AVES/data/mnist/ -- input data param (get from oss or mount)
 # /export/AVES/output/  -- output data param
 
+def scripts_configname(avesjob_id):
+    """ Name of the configmap/configs of aves scripts of a job
+    """
+    return 'job{id}-aves-scripts'.format(id=avesjob_id)
+
+
+def worker_status_report_url(worker_id):
+    return 'api/aves_worker/{id}/change_status/'.format(id=worker_id)
+
+
 class BaseMaker:
     def __init__(self, avesjob, target_worker):
         self.avesjob = avesjob
@@ -117,12 +127,17 @@ class BaseMaker:
             data.append(d)
         return data
 
+    def gen_scripts_configname(self):
+        """ configmap of aves scripts is shared by all workers of the job
+        """
+        return scripts_configname(self.avesjob.id)
+
     def gen_confdata_aves_scripts(self):
         """ generate configmap
 
         aves_run.sh, aves_config_aws.sh, aves_get_dist_envs.py, aves_report.py
         """
-        configname = '{id}-aves-scripts'.format(id=self.target_worker.id)
+        configname = self.gen_scripts_configname()
         data = {}
         aves_run_content = scripts_maker.gen_aves_run_script(self.sourcecode_spec, self.input_specs, self.output_specs, self.log_spec)
         data['aves_run.sh'] = aves_run_content
@@ -223,7 +238,7 @@ class BaseMaker:
         volume = {
             'name': 'aves-scripts',
             'configMap': {
-                'name': '{id}-aves-scripts'.format(id=self.target_worker.id),
+                'name': self.gen_scripts_configname(),
                 'items': [
                     {
                         'key': 'aves_run.sh',
@@ -371,7 +386,7 @@ class BaseMaker:
         envs.append(self._env_var('AVES_API_JOB_DIST_ENVS_URL', 'api/aves_job/{id}/distribute_envs/'.format(id=self.avesjob.id)))
         envs.append(self._env_var('AVES_API_JOB_REPORT_URL', 'api/aves_job/{id}/finish_job/'.format(id=self.avesjob.id)))
         envs.append(self._env_var('AVES_API_JOB_STATUS_REPORT_URL', 'api/aves_job/{id}/change_status/'.format(id=self.avesjob.id)))
-        envs.append(self._env_var('AVES_API_WORKER_STATUS_REPORT_URL', 'api/aves_worker/{id}/change_status/'.format(id=self.target_worker.id)))
+        envs.append(self._env_var('AVES_API_WORKER_STATUS_REPORT_URL', worker_status_report_url(self.target_worker.id)))
         envs.append(self._env_var('AVES_API_TOKEN', self.avesjob.api_token))
         return envs
 
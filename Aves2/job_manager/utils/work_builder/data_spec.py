@@ -3,8 +3,7 @@ import re
 import escapism
 
 from django.conf import settings
-from jinja2 import PackageLoader, Environment, FileSystemLoader
-from job_manager.utils.scripts_maker import TEMPLATE_PATH
+from job_manager.utils.scripts_maker import get_template_registry
 
 
 def make_safe_name(name):
@@ -113,10 +112,6 @@ class OSSFileDataSpec(VirtualDataSpec):
         self.storage_config = storage_config
 
     def gen_prepare_data_cmd(self):
-        tpl_path = TEMPLATE_PATH
-        env = Environment(loader=FileSystemLoader(tpl_path))
-        tpl = env.get_template(os.path.join('prepare_data_oss.sh.tmpl'))
-
         context = {
             'oss_endpoint': self.storage_config['endpoint'],
             'oss_profile': self.storage_config['profile_name'],
@@ -124,20 +119,16 @@ class OSSFileDataSpec(VirtualDataSpec):
             'filename': self.filename,
             'dst': self.aves_path
         }
-        return tpl.render(context)
+        return get_template_registry().render('prepare_data_oss.sh.tmpl', context)
 
     def gen_gather_data_cmd(self):
-        tpl_path = TEMPLATE_PATH
-        env = Environment(loader=FileSystemLoader(tpl_path))
-        tpl = env.get_template(os.path.join('gather_data_oss.sh.tmpl'))
-
         context = {
             'oss_endpoint': self.storage_config['endpoint'],
             'oss_profile': self.storage_config['profile_name'],
             'src': self.aves_path,
             'dst': os.path.join(self.src_path, self.filename),
         }
-        return tpl.render(context)
+        return get_template_registry().render('gather_data_oss.sh.tmpl', context)
 
     def gen_clean_data_cmd(self):
         return f'\\rm -rf {self.aves_path}/*'
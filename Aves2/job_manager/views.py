@@ -7,17 +7,28 @@ import json
 from django.http import StreamingHttpResponse, HttpResponse
 from django.shortcuts import render
 from django.conf import settings
+from django.utils import timezone
+from django.contrib.auth.models import User
+from django.utils.dateparse import parse_datetime
 
 from rest_framework import mixins
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.exceptions import APIException
-from rest_framework.decorators import api_view, list_route, detail_route, action
+from rest_framework.decorators import api_view, list_route, detail_route, action, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.authentication import SessionAuthentication
 
-from job_manager.models import AvesJob, AvesWorker
+from celery import states as celery_states
+from celery.result import AsyncResult
+
+from job_manager.models import AvesJob, AvesWorker, JobOperation
 from job_manager.serializer import AvesJobSerializer, AvesWorkerSerializer, WorkerLogSerializer
+from job_manager.pagination import AvesJobCursorPagination
+from job_manager.authentication import CachedTokenAuthentication
 from job_manager import tasks
+from job_manager.utils.log_mux import merge_worker_logs, get_max_workers
 from job_manager.aves2_schemas import validate_job, trans_job_data
 
 from kubernetes_client.client import k8s_client
@@ -25,6 +36,9 @@ from docker_client.client import doc_client
 
 logger = logging.getLogger('aves2')
 
+# authentication of the actions called back by workers
+WORKER_CALLBACK_AUTHENTICATION = [CachedTokenAuthentication, SessionAuthentication]
+
 
 def obtain_post_data(request):
     try:
@@ -35,6 +49,80 @@ def obtain_post_data(request):
     return data
 
 
+def parse_log_params(request):
+    """ Parse query params of the logs actions
+
+    follow, since_seconds, tail_lines, limitBytes, timestamps. Without
+    since_seconds and tail_lines the last AVES_LOG_DEFAULT_TAIL_LINES lines
+    are returned.
+    """
+    def to_bool(value):
+        return value.lower() in ('1', 'true', 'yes')
+
+    def to_int(name):
+        value = request.GET.get(name)
+        return int(value) if value not in (None, '') else None
+
+    try:
+        params = dict(
+            follow=to_bool(request.GET.get('follow', 'false')),
+            timestamps=to_bool(request.GET.get('timestamps', 'true')),
+            since_seconds=to_int('since_seconds'),
+            tail_lines=to_int('tail_lines'),
+            limit_bytes=to_int('limitBytes'),
+        )
+    except ValueError:
+        raise APIException(detail='Invalid request data: since_seconds tail_lines limitBytes must be integers', code=400)
+    if params['since_seconds'] is None and params['tail_lines'] is None:
+        params['tail_lines'] = getattr(settings, 'AVES_LOG_DEFAULT_TAIL_LINES', 2000)
+    return params
+
+
+def stream_log_response(lines):
+    """ Chunked text response of log lines, lines are pulled as the client reads
+    """
+    def gen_log():
+        try:
+            for line in lines:
+                yield '%s\r\n' % line
+        except Exception:
+            logger.error('Log stream broken', exc_info=True)
+        finally:
+            lines.close()
+
+    response = StreamingHttpResponse(gen_log(), content_type="text/plain")
+    # do not let a proxy buffer followed logs
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def register_operation(result, avesjob, operation):
+    """ Remember the owner of a queued lifecycle task
+
+    :return: False if celery_once rejected the task as a duplicate
+    """
+    # celery_once answers a duplicate with a REJECTED EagerResult
+    if result.id is None or result.state == celery_states.REJECTED:
+        return False
+    expire_time = timezone.now() - datetime.timedelta(seconds=getattr(settings, 'AVES_OPERATION_TTL', 24 * 3600))
+    JobOperation.objects.filter(create_time__lt=expire_time).delete()
+    JobOperation.objects.create(operation_id=result.id, operation=operation,
+                                job_id=avesjob.id, username=avesjob.username)
+    return True
+
+
+def operation_response(result, avesjob, operation):
+    """ 202 with the id of a queued lifecycle task, 409 if the same kind of
+    operation of the job is already queued
+    """
+    if not register_operation(result, avesjob, operation):
+        return Response(
+                {'error_msg': 'Another {0} of job {1} is in progress'.format(operation, avesjob.id)},
+                status=status.HTTP_409_CONFLICT)
+    return Response({'operationId': result.id, 'operation': operation, 'jobId': avesjob.id},
+                    status=status.HTTP_202_ACCEPTED)
+
+
 class AvesWorkerViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     """ A ViewSete for AvesWorker
     """
@@ -48,14 +136,15 @@ class AvesWorkerViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewse
 
     @action(detail=True, methods=['get'])
     def logs(self, request, pk):
-        def gen_log(logs):
-            for line in logs.splitlines():
-                yield '%s\r\n' % line
+        """ Stream worker log
 
+        Query params: follow, since_seconds, tail_lines, limitBytes, timestamps
+        """
         worker = self.get_object()
-        # TODO: support query params '?tail_lines=100'
-        rt = worker.get_worker_log(tail_lines=2000)
-        return StreamingHttpResponse(gen_log(rt), content_type="text/plain")
+        lines, err_msg = worker.stream_worker_log(**parse_log_params(request))
+        if lines is None:
+            return Response({'error_msg': err_msg}, status=status.HTTP_400_BAD_REQUEST)
+        return stream_log_response(lines)
 
     @action(detail=True, methods=['get'])
     def worker_info(self, request, pk):
@@ -68,7 +157,7 @@ class AvesWorkerViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewse
             data = {'error_msg': err_msg}
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], authentication_classes=WORKER_CALLBACK_AUTHENTICATION)
     def change_status(self, request, pk):
         worker = self.get_object()
         try:
@@ -86,14 +175,58 @@ class AvesWorkerViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewse
 
 class AvesJobViewSet(viewsets.ModelViewSet):
     """ A ViewSet for AvesJob
+
+    List query params:
+        fields: comma separated fields to return, unused JSON columns are not loaded
+        status, namespace: filter jobs, status can be comma separated
+        created_after, created_before: ISO 8601 datetime range of create_time
+        cursor, page_size: keyset pagination, see AvesJobCursorPagination
     """
     serializer_class = AvesJobSerializer
+    pagination_class = AvesJobCursorPagination
+
+    JSON_FIELDS = ('resource_spec', 'storage_config', 'envs', 'code_spec',
+                   'input_spec', 'output_spec', 'log_dir', 'worker_status_count')
+
+    def _get_sparse_fields(self):
+        fields = self.request.query_params.get('fields')
+        if not fields or self.action not in ['list', 'retrieve']:
+            return None
+        return [f for f in fields.split(',') if f]
+
+    def _filter_queryset_by_params(self, queryset):
+        params = self.request.query_params
+        if params.get('status'):
+            queryset = queryset.filter(status__in=params['status'].split(','))
+        if params.get('namespace'):
+            queryset = queryset.filter(namespace=params['namespace'])
+        for param, lookup in [('created_after', 'create_time__gte'), ('created_before', 'create_time__lt')]:
+            if params.get(param):
+                value = parse_datetime(params[param])
+                if value is None:
+                    raise APIException(detail=f'Invalid request data: {param} must be an ISO 8601 datetime', code=400)
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
 
     def get_queryset(self):
         if self.request.user.is_active and self.request.user.is_superuser:
-            return AvesJob.objects.all()
+            queryset = AvesJob.objects.all()
         else:
-            return AvesJob.objects.all().filter(username=self.request.user.username)
+            queryset = AvesJob.objects.all().filter(username=self.request.user.username)
+        if self.action != 'list':
+            return queryset
+
+        queryset = self._filter_queryset_by_params(queryset).order_by('-id')
+        fields = self._get_sparse_fields()
+        if fields is not None:
+            queryset = queryset.defer(*[f for f in self.JSON_FIELDS if f not in fields])
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self._get_sparse_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
 
     def create(self, request, *args, **kwargs):
         user = request.user
@@ -114,10 +247,10 @@ class AvesJobViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     def destroy(self, request, *args, **kwargs):
+        """ Delete workers of the job, then the job, in a celery task
+        """
         instance = self.get_object()
-        self.perform_destroy(instance)
-        instance.clean_work(force=True)
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return operation_response(tasks.destroy_avesjob.delay(instance.id), instance, 'destroy')
 
     @action(detail=True, methods=['get'])
     def start_job(self, request, pk):
@@ -126,49 +259,25 @@ class AvesJobViewSet(viewsets.ModelViewSet):
             err_msg = 'job is {0}'.format(avesjob.status)
             raise APIException(detail=err_msg)
 
-        avesjob.update_status('STARTING', '')
-        rt, err_msg = avesjob.start()
-        if not rt:
-            avesjob.update_status('FAILURE', err_msg)
-            raise APIException(
-                    detail='Fail to start job {0}. {1}'
-                           .format(avesjob, err_msg),
-                    code=400)
-        # TODO: report avesjob status: starting
-        # _report_avesjob_status(avesjob.merged_id, "STARTING")
-        return Response(status=status.HTTP_200_OK)
+        return operation_response(tasks.start_avesjob.delay(avesjob.id), avesjob, 'start')
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], authentication_classes=WORKER_CALLBACK_AUTHENTICATION)
     def distribute_envs(self, request, pk):
-        avesjob = self.get_object()
-        namespace = avesjob.namespace
-        selector = {'avesJobId': avesjob.id}
-
-        # TODO: make a better implementation
-        if settings.ENABLE_K8S:
-            data, msg = k8s_client.get_namespaced_pod_list(namespace, selector=selector)
-            if not data:
-                logger.error('Fail to get_namespaced_pod_list: namespace {0}, selector {1}. msg: {2}'.format(namespace, selector, msg))
-                raise APIException(detail='Fail to get job info', code=500)
-
-            if not data or not len(data) == avesjob.aves_worker.count():
-                raise APIException(detail='workers are not ready', code=400)
-
-            for pod in data:
-                if not (hasattr(pod.status, 'phase') and pod.status.phase == 'Running'):
-                    raise APIException(detail='worker {0} is not ready'.format(pod.metadata.name), code=400)
-        else:
-            data, msg = doc_client.list_containers(labels=selector)
-            if not data:
-                logger.error('Fail to list_containers: selector {0}. msg: {1}'.format(selector, msg))
-                raise APIException(detail='Fail to get job info', code=500)
+        """ Get cluster envs of a distributed job
 
-            if not data or not len(data) == avesjob.aves_worker.count():
-                raise APIException(detail='workers are not ready', code=400)
+        Query param `wait` (seconds) turns the call into a long-poll which
+        returns as soon as all workers are running.
+        """
+        avesjob = self.get_object()
+        try:
+            wait = float(request.GET.get('wait', 0))
+        except ValueError:
+            raise APIException(detail='Invalid request data: wait must be a number', code=400)
+        wait = max(0, min(wait, getattr(settings, 'AVES_DIST_ENVS_MAX_WAIT', 30)))
 
-            for container in data:
-                if container.status != 'running':
-                    raise APIException(detail='worker {0} is not ready'.format(container.labels.get('workerName')), code=400)
+        ready, msg = avesjob.wait_workers_ready(wait)
+        if not ready:
+            raise APIException(detail=msg, code=400)
 
         envs = avesjob.get_dist_envs()
         return Response(envs)
@@ -178,17 +287,13 @@ class AvesJobViewSet(viewsets.ModelViewSet):
         """
         """
         avesjob = self.get_object()
-        namespace = avesjob.namespace
+        return operation_response(tasks.clean_avesjob.delay(avesjob.id, force=True), avesjob, 'clean')
 
-        avesjob.clean_work(force=True)
-        return Response(status=status.HTTP_200_OK)
-
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], authentication_classes=WORKER_CALLBACK_AUTHENTICATION)
     def finish_job(self, request, pk):
         """
         """
         avesjob = self.get_object()
-        namespace = avesjob.namespace
 
         if not avesjob.status == 'RUNNING':
             logger.error(f'{avesjob}: try to stop a non-running job')
@@ -201,22 +306,19 @@ class AvesJobViewSet(viewsets.ModelViewSet):
             logger.error('Invalid request data', exc_info=True)
             raise APIException(detail='Invalid request data: status and msg are required', code=400)
         # update status
-        avesjob.update_status(job_status)
+        if not avesjob.update_status(job_status, msg):
+            raise APIException(detail='Job status has been changed by others', code=400)
         # clean k8s resource
-        avesjob.clean_work()
-        return Response(status=status.HTTP_200_OK)
+        return operation_response(tasks.clean_avesjob.delay(avesjob.id), avesjob, 'finish')
 
     @action(detail=True, methods=['get'])
     def cancel_job(self, request, pk):
         """ Cancel avesjob
         """
         avesjob = self.get_object()
-        avesjob.cancel()
-        avesjob.update_status('CANCELED')
-        # TODO: report status
-        return Response(status=status.HTTP_200_OK)
+        return operation_response(tasks.cancel_avesjob.delay(avesjob.id), avesjob, 'cancel')
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], authentication_classes=WORKER_CALLBACK_AUTHENTICATION)
     def change_status(self, request, pk):
         avesjob = self.get_object()
         try:
@@ -227,20 +329,48 @@ class AvesJobViewSet(viewsets.ModelViewSet):
             logger.error('Invalid request data', exc_info=True)
             raise APIException(detail='Invalid request data: status is required', code=400)
 
-        avesjob.update_status(job_status, msg)
+        # a failed change is logged, the worker does not retry its report
+        avesjob.transition_status(job_status, msg)
         return Response(status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['get'])
     def logs(self, request, pk):
-        def gen_log(logs):
-            for line in logs.splitlines():
-                yield '%s\r\n' % line
+        """ Stream log of the main node
 
+        Query params: follow, since_seconds, tail_lines, limitBytes, timestamps
+        """
         job = self.get_object()
         worker = job.aves_worker.filter(is_main_node=True)[0]
-        # TODO: support query params '?tail_lines=100'
-        rt = worker.get_worker_log(tail_lines=2000)
-        return StreamingHttpResponse(gen_log(rt), content_type="text/plain")
+        lines, err_msg = worker.stream_worker_log(**parse_log_params(request))
+        if lines is None:
+            return Response({'error_msg': err_msg}, status=status.HTTP_400_BAD_REQUEST)
+        return stream_log_response(lines)
+
+    @action(detail=True, methods=['get'])
+    def all_logs(self, request, pk):
+        """ Stream logs of all workers merged by timestamp
+
+        Query params: role (comma separated roles), follow, since_seconds,
+        tail_lines, limitBytes, timestamps
+
+        Each worker is read by its own thread and log stream, so a request
+        merging more than AVES_LOG_MUX_MAX_WORKERS (default 64) workers is
+        rejected with 400. Larger jobs have to select workers with role.
+        """
+        job = self.get_object()
+        log_params = parse_log_params(request)
+        workers = job.aves_worker.all().order_by('avesrole', 'role_index')
+        roles = request.GET.get('role')
+        if roles:
+            workers = workers.filter(avesrole__in=roles.split(','))
+        workers = list(workers)
+
+        max_workers = get_max_workers()
+        if len(workers) > max_workers:
+            err_msg = 'Too many workers: {0} > {1}, filter them by role'.format(len(workers), max_workers)
+            return Response({'error_msg': err_msg}, status=status.HTTP_400_BAD_REQUEST)
+        lines = merge_worker_logs(workers, log_params, AvesWorker._extract_timestamp)
+        return stream_log_response(lines)
 
     @action(detail=False, methods=['post'])
     def submit_avesjob(self, request):
@@ -271,6 +401,79 @@ class AvesJobViewSet(viewsets.ModelViewSet):
         rt = {'success': True, 'errorMessage': ''}
         return Response(rt)
 
+    @action(detail=False, methods=['post'])
+    def submit_avesjobs(self, request):
+        """ Submit jobs in bulk
+
+        Request data: {"jobs": [job, ...]}, each job as in submit_avesjob.
+        Valid jobs and their workers are inserted in one transaction, or one
+        by one if that fails, and started by one fan-out task. A job whose
+        jobId already exists, also one submitted concurrently, is not
+        submitted again and is reported with its existing id.
+
+        :return: {"success": all jobs accepted, "errorMessage": "",
+                  "results": [{"jobId", "success", "errorMessage", "id", "created"}]}
+        """
+        user = request.user
+        data = obtain_post_data(request)
+        jobs = data.get('jobs') if isinstance(data, dict) else None
+        max_jobs = getattr(settings, 'AVES_BULK_SUBMIT_MAX_JOBS', 500)
+        if not isinstance(jobs, list) or not jobs:
+            return Response({'success': False, 'errorMessage': 'jobs is required', 'results': []})
+        if len(jobs) > max_jobs:
+            msg = 'too many jobs: {0} > {1}'.format(len(jobs), max_jobs)
+            return Response({'success': False, 'errorMessage': msg, 'results': []})
+
+        job_ids = [job.get('jobId') for job in jobs if isinstance(job, dict)]
+        existing = dict(AvesJob.objects.filter(job_id__in=job_ids).values_list('job_id', 'id'))
+        results = []
+        new_jobs = []
+        seen = set()
+        for job in jobs:
+            job_id = job.get('jobId') if isinstance(job, dict) else None
+            result = {'jobId': job_id, 'success': False, 'errorMessage': '', 'id': None, 'created': False}
+            results.append(result)
+            ok, err = validate_job(job)
+            if err:
+                result['errorMessage'] = str(err)
+                continue
+            if job['username'] != user.username and not user.is_superuser:
+                result['errorMessage'] = 'cannot submit job with username {}'.format(job['username'])
+                continue
+            if job_id in existing:
+                result.update(success=True, id=existing[job_id])
+                continue
+            if job_id in seen:
+                result['errorMessage'] = 'duplicated jobId in request'
+                continue
+            serializer = self.get_serializer(data=trans_job_data(job))
+            if not serializer.is_valid():
+                result['errorMessage'] = json.dumps(serializer.errors)
+                continue
+            seen.add(job_id)
+            new_jobs.append((result, AvesJob(**serializer.validated_data)))
+
+        if new_jobs:
+            usernames = set(avesjob.username for _, avesjob in new_jobs)
+            known_users = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+            User.objects.bulk_create([User(username=name) for name in usernames - known_users],
+                                    ignore_conflicts=True)
+            saved = AvesJob.bulk_create_with_workers([avesjob for _, avesjob in new_jobs])
+            for result, avesjob in new_jobs:
+                pk, created, err = saved[avesjob.job_id]
+                if err:
+                    result['errorMessage'] = err
+                    continue
+                result.update(success=True, id=pk, created=created)
+        created_ids = [r['id'] for r in results if r['created']]
+        if created_ids:
+            tasks.start_avesjobs.delay(created_ids)
+
+        failed = [r for r in results if not r['success']]
+        logger.info('Bulk submit jobs: {0} submitted, {1} failed'.format(len(created_ids), len(failed)))
+        msg = '{0} of {1} jobs failed'.format(len(failed), len(results)) if failed else ''
+        return Response({'success': not failed, 'errorMessage': msg, 'results': results})
+
     @action(detail=False, methods=['post'])
     def delete_avesjob(self, request):
         # TODO: Not implemented delete_avesjob
@@ -293,15 +496,31 @@ class AvesJobViewSet(viewsets.ModelViewSet):
             rt = {'success': False, 'errorMessage': msg}
             return Response(rt)
 
-        # TODO: cancel job in celery task
-        try:
-            avesjob.cancel()
-            avesjob.update_status('CANCELED')
-            rt = {'success': True, 'errorMessage': ''}
-        except Exception as e:
-            logger.error('Cancel job failed: {}'.format(avesjob), exc_info=True)
-            rt = {'success': False, 'errorMessage': 'cancel job failed'}
-        return Response(rt)
+        result = tasks.cancel_avesjob.delay(avesjob.id, force=force)
+        if not register_operation(result, avesjob, 'cancel'):
+            rt = {'success': False, 'errorMessage': 'job is being canceled'}
+            return Response(rt, status=status.HTTP_409_CONFLICT)
+        rt = {'success': True, 'errorMessage': '', 'operationId': result.id}
+        return Response(rt, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'operations/(?P<operation_id>[^/]+)')
+    def operation(self, request, operation_id):
+        """ Progress of a lifecycle operation
+
+        state is one of PENDING, STARTED, PROGRESS, SUCCESS, FAILURE. info is
+        the current step while in progress, and the task result once done.
+        Users can only see operations of their own jobs.
+        """
+        owner = JobOperation.objects.filter(operation_id=operation_id).first()
+        user = request.user
+        if owner is None or not (user.is_superuser or owner.username == user.username):
+            return Response({'error_msg': 'Operation not found'}, status=status.HTTP_404_NOT_FOUND)
+        result = AsyncResult(operation_id)
+        info = result.info
+        if isinstance(info, Exception):
+            info = {'errorMessage': repr(info)}
+        return Response({'operationId': operation_id, 'operation': owner.operation, 'jobId': owner.job_id,
+                         'state': result.state, 'info': info})
 
     @action(detail=False, methods=['get'])
     def get_loginfo(self, request):
@@ -325,10 +544,11 @@ class AvesJobViewSet(viewsets.ModelViewSet):
             rt = {'success': False, 'errorMessage': msg}
             return Response(rt)
 
-        worker_set = AvesWorker.objects.filter(avesjob__job_id=job_id)
+        worker_set = avesjob.aves_worker.all()
         if role_id is not None:
-            worker_set = worker_set.filter(role_index=roleId)
-        serializer = WorkerLogSerializer(worker_set, many=True)
+            worker_set = worker_set.filter(role_index=role_id)
+        serializer = WorkerLogSerializer(worker_set, many=True,
+                                         context={'log_urls': avesjob.get_worker_log_urls()})
         return Response(serializer.data)
 
 
@@ -339,3 +559,13 @@ def client_check(request):
         return Response({'success': True, 'errorMessage': ''})
     else:
         return Response({'success': False, 'errorMessage': 'please upgrade client'})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def k8s_connection_stats(request):
+    """ Connection reuse of the k8s api client in this process
+    """
+    if k8s_client is None:
+        return Response({})
+    return Response(k8s_client.get_connection_stats())
@@ -4,3 +4,25 @@ class K8SPodPhase:
     SUCCEEDED = 'Succeeded'
     FAILED = 'Failed'
     UNKNOWN = 'Unknown'
+
+
+def pod_event_summary(event_type, pod):
+    """ Compact dict of a pod event, holding the fields aves2 reacts on only
+
+    :param event_type: ADDED/MODIFIED/DELETED
+    :param pod: kubernetes.client.models.v1_pod.V1Pod
+    """
+    waiting_reason = waiting_msg = None
+    container_statuses = pod.status.container_statuses if pod.status else None
+    if container_statuses and container_statuses[0].state and container_statuses[0].state.waiting:
+        waiting_reason = container_statuses[0].state.waiting.reason
+        waiting_msg = container_statuses[0].state.waiting.message
+    return {
+        'type': event_type,
+        'pod_name': pod.metadata.name,
+        'namespace': pod.metadata.namespace,
+        'worker_id': (pod.metadata.labels or {}).get('workerId'),
+        'phase': pod.status.phase if pod.status else None,
+        'waiting_reason': waiting_reason,
+        'waiting_msg': waiting_msg,
+    }
@@ -1,10 +1,15 @@
+import os
 import codecs
 import json
+import time
+import socket
 import logging
+import threading
 from django.conf import settings
 from kubernetes import client, config, watch
 from kubernetes.client.rest import ApiException
 from inspect import isfunction
+from urllib3.connection import HTTPConnection
 
 import kubernetes.client
 from kubernetes import config
@@ -16,17 +21,93 @@ from kubernetes.client import (
     V1RoleBinding, V1RoleRef, V1Subject,
 )
 
+from common_utils.log_stream import LogLines, LOG_CHUNK_SIZE
+from .informer import PodInformer
+
 
 logger = logging.getLogger('aves2')
 
+# interval workers used to poll distribute_envs at before it was a long-poll
+DIST_ENVS_POLL_INTERVAL = 10
+
 
 class K8SClient(object):
+    """ Sync client of the k8s api
+
+    All calls share one ApiClient per process. Its urllib3 pool keeps up to
+    AVES_K8S_POOL_MAXSIZE keep-alive connections per host, and the pool is
+    thread and greenlet safe. Calls time out after AVES_K8S_REQUEST_TIMEOUT
+    (connect, read) seconds. Followed logs and watches have no read timeout.
+    """
     def __init__(self):
         try:
             config.load_incluster_config()
         except config.ConfigException:
             config.load_kube_config()
 
+        self.pool_maxsize = getattr(settings, 'AVES_K8S_POOL_MAXSIZE', 20)
+        self.request_timeout = tuple(getattr(settings, 'AVES_K8S_REQUEST_TIMEOUT', (5, 60)))
+        self._api_lock = threading.Lock()
+        self._api_pid = None
+        self._api_client = None
+        self._core_api = None
+
+        # only processes serving frequent pod lookups (gunicorn, for the
+        # distribute_envs long-poll of workers) should keep a pod cache,
+        # celery disables it with AVES_POD_CACHE_ENABLED=no
+        pod_cache_enabled = os.environ.get('AVES_POD_CACHE_ENABLED', 'yes') == 'yes'
+        if getattr(settings, 'AVES_POD_CACHE_ENABLED', pod_cache_enabled):
+            label_selector = 'app={0}'.format(settings.AVES_JOB_LABEL)
+            self.pod_informer = PodInformer(label_selector, lambda: self.core_api)
+        else:
+            self.pod_informer = None
+
+    def _make_api_client(self):
+        configuration = kubernetes.client.Configuration()
+        configuration.connection_pool_maxsize = self.pool_maxsize
+        api_client = kubernetes.client.ApiClient(configuration)
+        # tcp keepalive, so idle pooled connections are not silently dropped
+        api_client.rest_client.pool_manager.connection_pool_kw['socket_options'] = \
+            HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        return api_client
+
+    @property
+    def core_api(self):
+        """ CoreV1Api on the shared ApiClient, rebuilt after fork
+        """
+        if self._api_pid != os.getpid():
+            with self._api_lock:
+                if self._api_pid != os.getpid():
+                    self._api_client = self._make_api_client()
+                    self._core_api = kubernetes.client.CoreV1Api(self._api_client)
+                    self._api_pid = os.getpid()
+        return self._core_api
+
+    def _log_request_timeout(self, follow):
+        if follow:
+            # a followed log is quiet for long, but not forever
+            return (self.request_timeout[0], getattr(settings, 'AVES_LOG_FOLLOW_READ_TIMEOUT', 600))
+        return self.request_timeout
+
+    def get_connection_stats(self):
+        """ Connection reuse of the shared ApiClient
+
+        :return: dict, requests and new connections made by the pools,
+                 connections reused = requests - connections
+        """
+        stats = {'pools': 0, 'requests': 0, 'connections': 0, 'pool_maxsize': self.pool_maxsize}
+        if self._api_client is None or self._api_pid != os.getpid():
+            return stats
+        pools = self._api_client.rest_client.pool_manager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['pools'] += 1
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+        return stats
+
     def handle_api_exception(fn):
         def fn_wrap(*args, **kwargs):
             try:
@@ -61,16 +142,16 @@ class K8SClient(object):
 
     @handle_api_exception
     def create_namespaced_configmap(self, configmap_manifest, namespace):
-        api = client.CoreV1Api()
+        api = self.core_api
         logger.info("create configmap in namespace {0}: {1}"
                     .format(namespace, configmap_manifest.metadata.name))
-        result = api.create_namespaced_config_map(namespace, configmap_manifest, pretty=True)
+        result = api.create_namespaced_config_map(namespace, configmap_manifest, pretty=True, _request_timeout=self.request_timeout)
         return result, None
 
     @handle_api_exception_with_not_found
     def delete_namespaced_configmap(self, name, namespace):
-        api = client.CoreV1Api()
-        result = api.delete_namespaced_config_map(name, namespace)
+        api = self.core_api
+        result = api.delete_namespaced_config_map(name, namespace, _request_timeout=self.request_timeout)
         return result, None
 
     @handle_api_exception
@@ -81,8 +162,8 @@ class K8SClient(object):
         :param namespace:
         :return: [api_response, errmsg]
         """
-        api = client.CoreV1Api()
-        result = api.create_namespaced_pod(namespace, pod_manifest)
+        api = self.core_api
+        result = api.create_namespaced_pod(namespace, pod_manifest, _request_timeout=self.request_timeout)
 
         logger.debug("create pod succeeded result: %s" % result)
         return result, None
@@ -110,18 +191,41 @@ class K8SClient(object):
         :param namespace: string
         :return: True, None or False, err_msg
         """
-        api = client.CoreV1Api()
+        api = self.core_api
         body = client.V1DeleteOptions()
         # Acceptable values are:
         # 'Orphan' - orphan the dependents;
         # 'Background' - allow the garbage collector to delete the dependents in the background;
         # 'Foreground' - a cascading policy that deletes all dependents in the foreground.
         body.propagation_policy = 'Background'
-        result = api.delete_namespaced_pod(name, namespace, body=body)
+        result = api.delete_namespaced_pod(name, namespace, body=body, _request_timeout=self.request_timeout)
 
         logger.info("delete_namespaced_pod name:%s succeeded" % (name))
         return result, None
 
+    @handle_api_exception
+    def delete_collection_namespaced_pod(self, namespace, label_selector):
+        """ Delete all pods matching label_selector with one call
+
+        :param label_selector: string, eg. "avesJobId=1,workerId!=2"
+        :return: [api_response, errmsg]
+        """
+        api = self.core_api
+        result = api.delete_collection_namespaced_pod(namespace, label_selector=label_selector,
+                                                      _request_timeout=self.request_timeout)
+        logger.info("delete_collection_namespaced_pod {0} {1} succeeded".format(namespace, label_selector))
+        return result, None
+
+    @handle_api_exception
+    def delete_collection_namespaced_configmap(self, namespace, label_selector):
+        """ Delete all configmaps matching label_selector with one call
+        """
+        api = self.core_api
+        result = api.delete_collection_namespaced_config_map(namespace, label_selector=label_selector,
+                                                             _request_timeout=self.request_timeout)
+        logger.info("delete_collection_namespaced_config_map {0} {1} succeeded".format(namespace, label_selector))
+        return result, None
+
     @handle_api_exception
     def get_namespaced_pod_list(self, namespace, selector=None):
         """
@@ -136,21 +240,46 @@ class K8SClient(object):
                 err_msg = condition
                 return None, err_msg
 
-        api = client.CoreV1Api()
+        api = self.core_api
         if condition is None:
-            result = api.list_namespaced_pod(namespace, watch=False)
+            result = api.list_namespaced_pod(namespace, watch=False, _request_timeout=self.request_timeout)
         else:
-            result = api.list_namespaced_pod(namespace, label_selector=condition, watch=False)
+            result = api.list_namespaced_pod(namespace, label_selector=condition, watch=False, _request_timeout=self.request_timeout)
 
         return result.items, None
 
+    def get_job_pod_list(self, namespace, job_id):
+        """ List pods of an avesjob
+
+        Pods are served from the local pod cache once it has synced,
+        otherwise fall back to a label-selector list call.
+
+        :return: [kubernetes.client.models.v1_pod.V1Pod], err_msg
+        """
+        if self.pod_informer is not None:
+            self.pod_informer.start()
+            if self.pod_informer.has_synced:
+                return self.pod_informer.list_job_pods(job_id), None
+        return self.get_namespaced_pod_list(namespace, selector={'avesJobId': job_id})
+
+    def wait_pod_change(self, timeout):
+        """ Block until a pod event is received or timeout
+
+        Without a synced pod cache there is no event source, just sleep
+        for the poll interval of workers (10s) so that callers list again.
+        """
+        if self.pod_informer is not None and self.pod_informer.has_synced:
+            self.pod_informer.wait_for_change(timeout)
+        else:
+            time.sleep(min(timeout, DIST_ENVS_POLL_INTERVAL))
+
     def watch_pod_for_all_namespaces(self, fn, label_selector):
         """  watch all the pod status change event
 
         :param fn: function to process event
         :param label_selector: pod label selector
         """
-        api = kubernetes.client.CoreV1Api()
+        api = self.core_api
         watcher = watch.Watch()
         for event in watcher.stream(api.list_pod_for_all_namespaces, label_selector=label_selector, pretty=True, watch=True):
             if not callable(fn):
@@ -160,16 +289,17 @@ class K8SClient(object):
 
     @handle_api_exception
     def get_pod_status(self, pod_name, namespace, status_only=True):
-        api = kubernetes.client.CoreV1Api()
-        result = api.read_namespaced_pod_status(pod_name, namespace=namespace)
+        api = self.core_api
+        result = api.read_namespaced_pod_status(pod_name, namespace=namespace, _request_timeout=self.request_timeout)
         if status_only:
             result = result.status
         return result, None
 
     @handle_api_exception
     def get_pod_log(self, pod_name, namespace, since_seconds=None, follow=False, tail_lines=None):
-        api = kubernetes.client.CoreV1Api()
-        kwargs = dict(follow=follow, timestamps=True, async_req=False)
+        api = self.core_api
+        kwargs = dict(follow=follow, timestamps=True, async_req=False,
+                      _request_timeout=self._log_request_timeout(follow))
         if since_seconds is not None:
             kwargs['since_seconds'] = since_seconds
         if tail_lines is not None:
@@ -177,65 +307,96 @@ class K8SClient(object):
         result = api.read_namespaced_pod_log(pod_name, namespace, **kwargs)
         return result, None
 
+    @handle_api_exception
+    def stream_pod_log(self, pod_name, namespace, follow=False, since_seconds=None,
+                       tail_lines=None, limit_bytes=None, timestamps=True):
+        """ Stream pod log line by line without loading it into memory
+
+        :return: [generator of log lines, errmsg]
+        """
+        api = self.core_api
+        kwargs = dict(follow=follow, timestamps=timestamps, _preload_content=False,
+                      _request_timeout=self._log_request_timeout(follow))
+        if since_seconds is not None:
+            kwargs['since_seconds'] = since_seconds
+        if tail_lines is not None:
+            kwargs['tail_lines'] = tail_lines
+        if limit_bytes is not None:
+            kwargs['limit_bytes'] = limit_bytes
+        resp = api.read_namespaced_pod_log(pod_name, namespace, **kwargs)
+
+        def close():
+            # drop the connection, a half read response can not go back to the pool
+            resp.close()
+            resp.release_conn()
+
+        def abort():
+            # closing the response from another thread does not wake up a
+            # blocked read, shutting down the socket does
+            sock = getattr(getattr(resp, '_connection', None), 'sock', None)
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+        return LogLines(resp.stream(LOG_CHUNK_SIZE), on_close=close, on_abort=abort), None
+
     @handle_api_exception
     def create_namespaced_pvc(self, pvc_manifest, namespace):
-        api = kubernetes.client.CoreV1Api()
-        result = api.create_namespaced_persistent_volume_claim(namespace=namespace, body=pvc_manifest)
+        api = self.core_api
+        result = api.create_namespaced_persistent_volume_claim(namespace=namespace, body=pvc_manifest, _request_timeout=self.request_timeout)
         logger.info("create pvc succeeded result: %s" % result)
         return result, None
 
     @handle_api_exception_with_not_found
     def delete_namespaced_pvc(self, name, namespace):
-        api = kubernetes.client.CoreV1Api()
-        result = api.delete_namespaced_persistent_volume_claim(name=name, namespace=namespace)
+        api = self.core_api
+        result = api.delete_namespaced_persistent_volume_claim(name=name, namespace=namespace, _request_timeout=self.request_timeout)
         logger.info("delete_namespaced_pvc name:%s succeeded" % (name))
         return result, None
 
     @handle_api_exception
     def create_namespace(self, name):
-        api = kubernetes.client.CoreV1Api()
+        api = self.core_api
         meta = V1ObjectMeta(name=name)
         namespace = V1Namespace(metadata=meta)
-        result = api.create_namespace(body=namespace)
+        result = api.create_namespace(body=namespace, _request_timeout=self.request_timeout)
         logger.info("create namespace succeed result: %s" % result)
         return result, None
 
     @handle_api_exception_with_not_found
     def delete_namespace(self, name):
-        api = kubernetes.client.CoreV1Api()
-        result = api.delete_namespace(name)
+        api = self.core_api
+        result = api.delete_namespace(name, _request_timeout=self.request_timeout)
         logger.info("delete namespace succeed name: %s" % name)
         return result, None
 
     @handle_api_exception
     def get_namespace_list(self):
-        api = kubernetes.client.CoreV1Api()
-        resp = api.list_namespace()
+        api = self.core_api
+        resp = api.list_namespace(_request_timeout=self.request_timeout)
         return resp.items, None
 
     @handle_api_exception
     def get_namespaced_pvc_list(self, namespace):
-        api = kubernetes.client.CoreV1Api()
-        resp = api.list_namespaced_persistent_volume_claim(namespace=namespace)
+        api = self.core_api
+        resp = api.list_namespaced_persistent_volume_claim(namespace=namespace, _request_timeout=self.request_timeout)
         return resp.items, None
 
     @handle_api_exception
     def create_namespaced_resource_quota(self, resource_quota_manifest, namespace):
-        api = kubernetes.client.CoreV1Api()
-        result = api.create_namespaced_resource_quota(body=resource_quota_manifest, namespace=namespace)
+        api = self.core_api
+        result = api.create_namespaced_resource_quota(body=resource_quota_manifest, namespace=namespace, _request_timeout=self.request_timeout)
         logger.info("create resource_quota in namespace {0}: {1}".format(namespace, resource_quota_manifest))
         return result, None
 
     @handle_api_exception
     def get_namespaced_resource_quota_list(self, namespace):
-        api = kubernetes.client.CoreV1Api
-        resp = api.list_namespaced_resource_quota(namespace)
+        api = self.core_api
+        resp = api.list_namespaced_resource_quota(namespace, _request_timeout=self.request_timeout)
         return resp.items, None
 
     @handle_api_exception_with_not_found
     def delete_namespaced_resource_quota(self, name, namespace):
-        api = kubernetes.client.CoreV1Api()
-        result = api.delete_namespaced_resource_quota(name, namespace)
+        api = self.core_api
+        result = api.delete_namespaced_resource_quota(name, namespace, _request_timeout=self.request_timeout)
         logger.info("delete resource_quota name: {0}".format(name))
         return result, None
 
@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+import threading
+
+from kubernetes import watch
+
+
+logger = logging.getLogger('aves2')
+
+
+class PodInformer(object):
+    """ Local pod cache kept up to date from a single watch stream
+
+    The informer lists all pods matching label_selector once, then applies
+    watch events to an in-memory store. Pods are indexed by the `avesJobId`
+    and `workerId` labels so that lookups never hit the api server.
+
+    The watch thread is started lazily by `start()` and restarted after a
+    fork (gunicorn/celery workers), since threads do not survive fork. Each
+    process running an informer keeps one watch connection of the pooled
+    ApiClient busy and a copy of all aves pods in memory.
+
+    :param get_api: callable returning the CoreV1Api to list and watch with
+    """
+    def __init__(self, label_selector, get_api, watch_timeout=300, retry_interval=5):
+        self.label_selector = label_selector
+        self.get_api = get_api
+        self.watch_timeout = watch_timeout
+        self.retry_interval = retry_interval
+
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._pid = None
+        self._thread = None
+        self._synced = False
+        self._resource_version = None
+        self._pods = {}            # (namespace, name) -> V1Pod
+        self._job_index = {}       # avesJobId -> set((namespace, name))
+        self._worker_index = {}    # workerId -> (namespace, name)
+
+    @property
+    def has_synced(self):
+        return self._synced
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._reset([], None)
+            self._thread = threading.Thread(target=self._run, name='aves-pod-informer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def list_job_pods(self, job_id):
+        with self._lock:
+            keys = self._job_index.get(str(job_id), ())
+            return [self._pods[k] for k in keys]
+
+    def get_worker_pod(self, worker_id):
+        with self._lock:
+            key = self._worker_index.get(str(worker_id))
+            return self._pods.get(key) if key else None
+
+    def wait_for_change(self, timeout):
+        """ Block until the store is changed by a watch event or timeout
+        """
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                self._list_and_watch()
+            except Exception:
+                logger.error('pod informer: watch stream broken, relist later', exc_info=True)
+            self._synced = False
+            time.sleep(self.retry_interval)
+
+    def _list_and_watch(self):
+        api = self.get_api()
+        resp = api.list_pod_for_all_namespaces(label_selector=self.label_selector)
+        self._reset(resp.items, resp.metadata.resource_version)
+        logger.info('pod informer: synced {0} pods at resourceVersion {1}'
+                    .format(len(resp.items), self._resource_version))
+
+        while True:
+            watcher = watch.Watch()
+            for event in watcher.stream(
+                            api.list_pod_for_all_namespaces,
+                            label_selector=self.label_selector,
+                            resource_version=self._resource_version,
+                            timeout_seconds=self.watch_timeout):
+                if event['type'] == 'ERROR':
+                    # 410 Gone: resourceVersion is too old, relist
+                    logger.info('pod informer: watch error {0}'.format(event['raw_object']))
+                    return
+                pod = event['object']
+                if event['type'] == 'DELETED':
+                    self._delete(pod)
+                else:
+                    self._update(pod)
+                self._resource_version = pod.metadata.resource_version
+
+    def _key(self, pod):
+        return (pod.metadata.namespace, pod.metadata.name)
+
+    def _reset(self, pods, resource_version):
+        with self._lock:
+            self._pods = {}
+            self._job_index = {}
+            self._worker_index = {}
+            for pod in pods:
+                self._update(pod)
+            self._resource_version = resource_version
+            self._synced = resource_version is not None
+            self._changed.notify_all()
+
+    def _update(self, pod):
+        key = self._key(pod)
+        labels = pod.metadata.labels or {}
+        with self._lock:
+            self._pods[key] = pod
+            if labels.get('avesJobId'):
+                self._job_index.setdefault(labels['avesJobId'], set()).add(key)
+            if labels.get('workerId'):
+                self._worker_index[labels['workerId']] = key
+            self._changed.notify_all()
+
+    def _delete(self, pod):
+        key = self._key(pod)
+        labels = pod.metadata.labels or {}
+        with self._lock:
+            self._pods.pop(key, None)
+            job_keys = self._job_index.get(labels.get('avesJobId'))
+            if job_keys is not None:
+                job_keys.discard(key)
+                if not job_keys:
+                    self._job_index.pop(labels.get('avesJobId'))
+            if self._worker_index.get(labels.get('workerId')) == key:
+                self._worker_index.pop(labels.get('workerId'))
+            self._changed.notify_all()
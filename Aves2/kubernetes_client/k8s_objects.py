@@ -33,6 +33,7 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 Helper methods for generating k8s API objects.
 """
+import copy
 import json
 import re
 from urllib.parse import urlparse
@@ -58,10 +59,10 @@ from kubernetes.client.models import (
 )
 
 
-def make_configmap(configname, data):
+def make_configmap(configname, data, labels=None):
     configmap = V1ConfigMap(
                     data=data,
-                    metadata=V1ObjectMeta(name=configname)
+                    metadata=V1ObjectMeta(name=configname, labels=(labels or {}).copy())
                 )
     return configmap
 
@@ -444,6 +445,48 @@ def make_pod(
     return pod
 
 
+def clone_pod(template, name, labels=None, env=None):
+    """
+    Make a pod from a template made by make_pod, for workers which differ
+    only in name, labels and a few env vars of the worker container.
+
+    Only the objects on the path to the changed fields are copied, the rest
+    of the spec (volumes, resources, affinity, ...) is shared with the
+    template, so the template and its clones must not be modified in place.
+
+    Parameters
+    ----------
+    name
+        Name of the new pod.
+    labels
+        Labels of the new pod, defaults to the labels of the template.
+    env
+        Dictionary of environment variables of the worker container to set.
+    """
+    pod = copy.copy(template)
+    pod.metadata = copy.copy(template.metadata)
+    pod.metadata.name = name
+    pod.metadata.labels = dict(template.metadata.labels if labels is None else labels)
+    pod.metadata.annotations = dict(template.metadata.annotations or {})
+    pod.spec = copy.copy(template.spec)
+    pod.spec.containers = list(template.spec.containers)
+    if env:
+        for index, container in enumerate(pod.spec.containers):
+            if container.name != 'worker':
+                continue
+            container = copy.copy(container)
+            pending = dict(env)
+            envs = []
+            for env_var in container.env or []:
+                if env_var.name in pending:
+                    env_var = V1EnvVar(env_var.name, pending.pop(env_var.name))
+                envs.append(env_var)
+            envs.extend(V1EnvVar(k, v) for k, v in pending.items())
+            container.env = envs
+            pod.spec.containers[index] = container
+    return pod
+
+
 def make_pvc(
     name,
     storage_class,
@@ -30,3 +30,12 @@ Create chart name and version as used by the chart label.
 {{- define "aves2.chart" -}}
 {{- printf "%s-%s" .Chart.Name .Chart.Version | replace "+" "_" | trunc 63 | trimSuffix "-" -}}
 {{- end -}}
+
+{{/*
+Url of the bundled redis, empty if it is disabled.
+*/}}
+{{- define "aves2.redisUrl" -}}
+{{- if .Values.redis.enabled -}}
+{{- printf "redis://%s-redis.%s:6379" (include "aves2.fullname" .) .Release.Namespace -}}
+{{- end -}}
+{{- end -}}
@@ -5,6 +5,10 @@ import multiprocessing
 bind = "0.0.0.0:" + os.getenv('DJANGO_PORT', '8080')
 # workers = multiprocessing.cpu_count() * 2 + 1
 workers = int(os.getenv('CPU_NUMS', multiprocessing.cpu_count())) * 2 + 1
+# distribute_envs is a long-poll api, async workers keep it from
+# blocking the whole worker process
+worker_class = "gevent"
+worker_connections = 1000
 max_requests = 10000
 max_requests_jitter = 100
 timeout = 60
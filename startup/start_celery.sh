@@ -19,6 +19,8 @@ ENV_FILE=$1
 
 [ -f ${ENV_FILE} ] || err "${ENV_FILE} is not exist"
 source ${ENV_FILE}
+# pod lookups of celery tasks are rare, do not keep a pod cache per worker
+export AVES_POD_CACHE_ENABLED="no"
 
 [ ! -z ${DJANGO_PROJ_PATH} ] || err "${DJANGO_PROJ_PATH} is not defined"
 